@@ -1,28 +1,42 @@
-from telegram import Update
-from telegram.ext import CommandHandler, ContextTypes
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram.error import BadRequest
 import datetime
-from database import get_all_pending_users, approve_user
+import hashlib
+import html
+from database import aget_all_pending_users, aapprove_user
 from config import APPROVAL_MODE
-from database import set_toggle, get_toggle
+from database import aset_toggle, get_toggle
 from config import ADMINS, WARN_THRESHOLD
+from content_filter import KINDS, MAX_PATTERN_LENGTH, aadd_rule, aremove_rule, alist_rules
+from archive import asearch_archive
+from fanout import delivery, fan_out, broadcast_text, send_controller, RECENT_BROADCASTS
+from handlers.anti_spam import STAGE_STATS
+from handlers.chat import clip
 from database import (
-    is_admin, get_user_by_username, get_user, set_admin, remove_admin, ban_user, unban_user,
-    mute_user, unmute_user, warn_user, reset_warns, get_warns, get_all_admins,
-    log_admin_action, get_modhistory, get_admin_log, kick_user, approve_user, reject_user,
-    get_all_pending_users, set_welcome, get_welcome, set_pinned, clear_pinned, get_pinned,
-    set_user_pinned_msg, get_user_pinned_msg, clear_all_user_pinned_msgs, get_message_by_id,
-    get_all_joined_users, delete_message, map_telegram_to_db, get_db_id_from_telegram,
-    get_telegram_message_ids_for_db_message, get_toggle, set_toggle
+    is_admin, aget_user_by_username, aget_user, aset_admin, aremove_admin, aban_user, aunban_user,
+    amute_user, aunmute_user, awarn_user, areset_warns, aget_warns, aget_all_admins,
+    alog_admin_action, aget_modhistory, aget_admin_log, akick_user, aapprove_user, areject_user,
+    aget_all_pending_users, aset_welcome, aget_welcome, aset_pinned, aclear_pinned, aget_pinned,
+    aget_message_by_id, get_all_joined_users, amap_telegram_to_db, aget_db_id_from_telegram, get_toggle, aset_toggle,
+    count_joined_users, count_pending_users, count_dormant_users, apurge_message,
+    aget_user_pinned_msgs, asave_user_pinned_msgs, aclear_all_user_pinned_msgs, aget_users_page, USER_FILTERS,
+    asearch_messages, aget_name_history
 )
 
-def parse_user_arg(arg):
+DELETE_BATCH = 100  # message ids per deleteMessages call (Telegram's limit)
+
+def pin_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+async def parse_user_arg(arg):
     if arg.startswith("@"):
-        target = get_user_by_username(arg)
+        target = await aget_user_by_username(arg)
         if not target:
             return None, None
         return target[0], target[1]
     elif arg.isdigit():
-        target = get_user(int(arg))
+        target = await aget_user(int(arg))
         if not target:
             return None, None
         return target[0], target[1]
@@ -52,11 +66,20 @@ async def adminhelp(update, context):
         "<code>/modhistory @username</code> - All mod actions for user\n"
         "<code>/togglelinks</code> - Toggle link ban\n"
         "<code>/togglemedia</code> - Toggle media ban\n"
+        "<code>/block domain|keyword|invite pattern</code> - Add a blocklist rule\n"
+        "<code>/unblock domain|keyword|invite pattern</code> - Remove a blocklist rule\n"
+        "<code>/blocklist</code> - Show blocklist rules\n"
         "<code>/toggleapproval</code> - Toggle approval mode\n"
         "<code>/members</code> - Show current member count\n"
+        "<code>/users [vendors|warned|muted]</code> - List members, page by page\n"
+        "<code>/search words [from:@user] [since:date] [until:date] [in:archive]</code> - Search chat history\n"
         "<code>/status</code> - Bot stats\n"
         "<code>/setvendor @username</code> - Mark user as vendor\n"
         "<code>/removevendor @username</code> - Remove vendor status\n"
+        "<code>/lockdown</code> / <code>/unlock</code> - Only admins may chat\n"
+        "<code>/silent</code> / <code>/unsilent</code> - Announcement-only mode\n"
+        "<code>/notice text</code> / <code>/unnotice</code> - Broadcast or clear the pinned notice\n"
+        "<code>/motd message</code> - Send message of the day\n"
     ).replace("{warns}", str(WARN_THRESHOLD))
 
     await update.message.reply_html(text)
@@ -65,13 +88,13 @@ async def approveall(update, context):
     user = update.effective_user
     if not is_admin(user.id):
         return
-    pendings = get_all_pending_users()
+    pendings = await aget_all_pending_users()
     if not pendings:
         await update.message.reply_text("No users pending approval.")
         return
     count = 0
     for u in pendings:
-        approve_user(u[0])
+        await aapprove_user(u[0])
         count += 1
     await update.message.reply_text(f"Approved all pending users ({count} total).")
 
@@ -80,7 +103,7 @@ async def toggleapproval(update, context):
     if not is_admin(user.id):
         return
     current = get_toggle("approval_mode")
-    set_toggle("approval_mode", 0 if current else 1)
+    await aset_toggle("approval_mode", 0 if current else 1)
     state = "ON" if not current else "OFF"
     await update.message.reply_text(f"Approval mode is now {state}.")
 
@@ -94,7 +117,7 @@ async def namehistory(update, context):
     # Get user id
     arg = context.args[0]
     if arg.startswith("@"):
-        target = get_user_by_username(arg)
+        target = await aget_user_by_username(arg)
         if not target:
             await update.message.reply_text(f"User {arg} not found.")
             return
@@ -105,7 +128,7 @@ async def namehistory(update, context):
         except Exception:
             await update.message.reply_text("Invalid user id.")
             return
-    hist = get_name_history(target_id, limit=20)
+    hist = await aget_name_history(target_id, limit=20)
     if not hist:
         await update.message.reply_text("No name history found for this user.")
         return
@@ -124,12 +147,12 @@ async def ban(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /ban @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
-    ban_user(target_id)
-    log_admin_action(user.id, target_id, "ban", "Permanent ban")
+    await aban_user(target_id)
+    await alog_admin_action(user.id, target_id, "ban", "Permanent ban")
     await update.message.reply_text(
         f"User @{target_username or target_id} has been permanently banned."
     )
@@ -141,17 +164,17 @@ async def unban(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /unban @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
-    unban_user(target_id)
-    log_admin_action(user.id, target_id, "unban", "Unban")
+    await aunban_user(target_id)
+    await alog_admin_action(user.id, target_id, "unban", "Unban")
     await update.message.reply_text(
         f"User @{target_username or target_id} has been unbanned."
     )
 
-from database import set_vendor, remove_vendor, is_vendor
+from database import aset_vendor, aremove_vendor, is_vendor
 
 async def setvendor(update, context):
     user = update.effective_user
@@ -160,12 +183,12 @@ async def setvendor(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /setvendor @username or user_id")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
-    set_vendor(target_id)
-    log_admin_action(user.id, target_id, "setvendor", "Marked as vendor")
+    await aset_vendor(target_id)
+    await alog_admin_action(user.id, target_id, "setvendor", "Marked as vendor")
     await update.message.reply_text(
         f"User @{target_username or target_id} has been marked as a VENDOR."
     )
@@ -177,12 +200,12 @@ async def removevendor(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /removevendor @username or user_id")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
-    remove_vendor(target_id)
-    log_admin_action(user.id, target_id, "removevendor", "Vendor role removed")
+    await aremove_vendor(target_id)
+    await alog_admin_action(user.id, target_id, "removevendor", "Vendor role removed")
     await update.message.reply_text(
         f"User @{target_username or target_id} is no longer a VENDOR."
     )
@@ -194,13 +217,13 @@ async def mute(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /mute @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
     until = int(datetime.datetime.now().timestamp()) + 3600
-    mute_user(target_id, until)
-    log_admin_action(user.id, target_id, "mute", "Muted 1h")
+    await amute_user(target_id, until)
+    await alog_admin_action(user.id, target_id, "mute", "Muted 1h")
     await update.message.reply_text(
         f"User @{target_username or target_id} has been muted for 1 hour."
     )
@@ -212,12 +235,12 @@ async def unmute(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /unmute @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
-    unmute_user(target_id)
-    log_admin_action(user.id, target_id, "unmute", "Unmute")
+    await aunmute_user(target_id)
+    await alog_admin_action(user.id, target_id, "unmute", "Unmute")
     await update.message.reply_text(
         f"User @{target_username or target_id} has been unmuted."
     )
@@ -229,16 +252,16 @@ async def warn(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /warn @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
-    warns = warn_user(target_id)
-    log_admin_action(user.id, target_id, "warn", f"Warned, now {warns}")
+    warns = await awarn_user(target_id)
+    await alog_admin_action(user.id, target_id, "warn", f"Warned, now {warns}")
     msg = f"User @{target_username or target_id} warned. Total warns: {warns}"
     if warns >= WARN_THRESHOLD:
-        ban_user(target_id)
-        log_admin_action(user.id, target_id, "autoban", f"Auto-banned at {warns} warns")
+        await aban_user(target_id)
+        await alog_admin_action(user.id, target_id, "autoban", f"Auto-banned at {warns} warns")
         msg += f"\nAuto-banned after {warns} warns!"
     await update.message.reply_text(msg)
 
@@ -249,12 +272,12 @@ async def resetwarn(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /resetwarn @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
-    reset_warns(target_id)
-    log_admin_action(user.id, target_id, "resetwarn", "Warns reset")
+    await areset_warns(target_id)
+    await alog_admin_action(user.id, target_id, "resetwarn", "Warns reset")
     await update.message.reply_text(
         f"User @{target_username or target_id}'s warns have been reset."
     )
@@ -265,22 +288,27 @@ async def delete(update, context):
         await update.message.reply_text("Reply to the message you want to delete with /delete")
         return
     reply_msg = update.message.reply_to_message
-    reply_to_id = get_db_id_from_telegram(reply_msg.message_id)
-    msg = get_message_by_id(reply_to_id) if reply_to_id else None
+    reply_to_id = await aget_db_id_from_telegram(user.id, reply_msg.message_id)
+    msg = await aget_message_by_id(reply_to_id) if reply_to_id else None
     if not msg:
         await update.message.reply_text("Original message not found.")
         return
     if not (is_admin(user.id) or user.id == msg[1]):
         await update.message.reply_text("You can only delete your own messages.")
         return
-    delete_message(msg[0])
-    log_admin_action(user.id, msg[1], "delete", "Deleted message")
-    mapping = get_telegram_message_ids_for_db_message(msg[0])
-    for user_id, telegram_msg_id in mapping:
-        try:
-            await context.bot.delete_message(chat_id=user_id, message_id=telegram_msg_id)
-        except Exception:
-            pass
+    copies, unsent = await apurge_message(msg[0])
+    delivery.cancel(msg[0], unsent)
+    await alog_admin_action(user.id, msg[1], "delete", "Deleted message")
+    chats = {}
+    for user_id, telegram_msg_id in copies:
+        chats.setdefault(user_id, []).append(telegram_msg_id)
+
+    async def send(uid):
+        ids = chats[uid]
+        for i in range(0, len(ids), DELETE_BATCH):
+            await context.bot.delete_messages(uid, ids[i:i + DELETE_BATCH])
+
+    await fan_out(list(chats), send, label=f"delete {msg[0]}")
     await update.message.reply_text("Message deleted from chat.")
 
 async def kick(update, context):
@@ -290,51 +318,171 @@ async def kick(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /kick @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
-    kick_user(target_id)
-    log_admin_action(user.id, target_id, "kick", "Removed from chat")
-    joined_users = get_all_joined_users()
-    for uid in joined_users:
-        try:
-            await context.bot.send_message(
-                uid,
-                f"🚫 User @{target_username or target_id} has been kicked from the chat."
-            )
-        except Exception:
-            pass
+    await akick_user(target_id)
+    await alog_admin_action(user.id, target_id, "kick", "Removed from chat")
+    await broadcast_text(
+        context.bot,
+        get_all_joined_users(),
+        f"🚫 User @{target_username or target_id} has been kicked from the chat.",
+        label="kick",
+    )
+
+# Names are clipped so a full page stays under Telegram's 4096 characters:
+# id (20) + @username (32) + name (32) + tags (~25) is ~111 per line at most.
+USERS_PAGE_SIZE = 30
+USERS_NAME_CHARS = 32
+
+def users_page(filter, rows, has_prev, has_next):
+    now = int(datetime.datetime.now().timestamp())
+    lines = []
+    for uid, username, name, vendor, warns, muted_until, dormant in rows:
+        line = f"<code>{uid}</code>: "
+        name = html.escape(clip(name or "", USERS_NAME_CHARS))
+        if username:
+            line += f"@{html.escape(clip(username, USERS_NAME_CHARS))} ({name})"
+        else:
+            line += name
+        if vendor:
+            line += " [VENDOR]"
+        if warns:
+            line += f" ⚠️{warns}"
+        if muted_until and muted_until > now:
+            line += " 🔇"
+        if dormant:
+            line += " 💤"
+        lines.append(line)
+    title = "All Users" if filter == "all" else f"Users ({filter})"
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("« Prev", callback_data=f"users:{filter}:p:{rows[0][0]}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next »", callback_data=f"users:{filter}:n:{rows[-1][0]}"))
+    markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return f"<b>{title}:</b>\n" + "\n".join(lines), markup
 
 async def users_list(update, context):
     user = update.effective_user
     if not is_admin(user.id):
         return
-
-    user_ids = get_all_joined_users()
-    if not user_ids:
+    filter = context.args[0].lower() if context.args else "all"
+    if filter not in USER_FILTERS:
+        await update.message.reply_text("Usage: /users [vendors|warned|muted]")
+        return
+    rows, has_prev, has_next = await aget_users_page(limit=USERS_PAGE_SIZE, filter=filter)
+    if not rows:
         await update.message.reply_text("No users found.")
         return
+    text, markup = users_page(filter, rows, has_prev, has_next)
+    await update.message.reply_html(text, reply_markup=markup)
 
-    lines = []
-    for uid in user_ids:
-        u = get_user(uid)
-        name = u[2]
-        username = u[1]
-        line = f"<code>{uid}</code>: "
-        if username:
-            line += f"@{username} ({name})"
+async def users_page_button(update, context):
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(query.from_user.id):
+        return
+    _, filter, direction, cursor = query.data.split(":")
+    if filter not in USER_FILTERS:
+        return
+    cursor = int(cursor)
+    rows, has_prev, has_next = await aget_users_page(
+        after=cursor if direction == "n" else None,
+        before=cursor if direction == "p" else None,
+        limit=USERS_PAGE_SIZE,
+        filter=filter,
+    )
+    if not rows:
+        return
+    text, markup = users_page(filter, rows, has_prev, has_next)
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
+
+SEARCH_PAGE_SIZE = 10
+SEARCH_USAGE = "Usage: /search words [from:@username] [since:YYYY-MM-DD] [until:YYYY-MM-DD] [in:archive]"
+
+async def parse_search_args(args):
+    # Returns (terms, filters) or None when a filter value is invalid.
+    terms, filters = [], {}
+    for arg in args:
+        key, _, value = arg.partition(":")
+        if arg == "in:archive":
+            filters["archive"] = True
+        elif key == "from" and value:
+            target_id, _ = await parse_user_arg(value)
+            if not target_id:
+                return None
+            filters["user_id"] = target_id
+        elif key in ("since", "until") and value:
+            try:
+                day = datetime.datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                return None
+            if key == "until":
+                day += datetime.timedelta(days=1)
+            filters[key] = int(day.timestamp())
         else:
-            line += f"{name}"
-        lines.append(line)
+            terms.append(arg)
+    return terms, filters
 
-    await update.message.reply_html("<b>All Users:</b>\n" + "\n".join(lines))
+async def run_search(terms, filters, offset):
+    # in:archive searches the archived months instead of the live index.
+    filters = dict(filters)
+    if filters.pop("archive", False):
+        return await asearch_archive(terms, offset=offset, limit=SEARCH_PAGE_SIZE, **filters)
+    return await asearch_messages(terms, offset=offset, limit=SEARCH_PAGE_SIZE, **filters)
+
+def search_page(rows, offset, has_next):
+    lines = []
+    for msg_id, user_id, username, name, snippet, ts in rows:
+        when = datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+        text = html.escape(snippet or "").replace("\x02", "<u>").replace("\x03", "</u>")
+        lines.append(f"<code>#{msg_id}</code> <i>{when}</i> <b>{html.escape(name or username or str(user_id))}</b>: {text}")
+    buttons = []
+    if offset:
+        buttons.append(InlineKeyboardButton("« Prev", callback_data=f"search:{max(0, offset - SEARCH_PAGE_SIZE)}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next »", callback_data=f"search:{offset + SEARCH_PAGE_SIZE}"))
+    markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    header = f"<b>Search results {offset + 1}-{offset + len(rows)}:</b>\n"
+    return header + "\n".join(lines), markup
+
+async def search(update, context):
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+    parsed = await parse_search_args(context.args or [])
+    if not parsed or not parsed[0]:
+        await update.message.reply_text(SEARCH_USAGE)
+        return
+    terms, filters = parsed
+    rows, has_next = await run_search(terms, filters, 0)
+    if not rows:
+        await update.message.reply_text("No messages found.")
+        return
+    context.user_data["search"] = parsed
+    text, markup = search_page(rows, 0, has_next)
+    await update.message.reply_html(text, reply_markup=markup)
+
+async def search_page_button(update, context):
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(query.from_user.id) or "search" not in context.user_data:
+        return
+    terms, filters = context.user_data["search"]
+    offset = int(query.data.split(":")[1])
+    rows, has_next = await run_search(terms, filters, offset)
+    if not rows:
+        return
+    text, markup = search_page(rows, offset, has_next)
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
 
 async def pending(update, context):
     user = update.effective_user
     if not is_admin(user.id):
         return
-    pendings = get_all_pending_users()
+    pendings = await aget_all_pending_users()
     if not pendings:
         await update.message.reply_text("No users pending approval.")
         return
@@ -350,29 +498,25 @@ async def approve(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /approve @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found or not pending.")
         return
-    approve_user(target_id)
-    log_admin_action(user.id, target_id, "approve", "User approved")
-    from database import get_user, get_all_joined_users, get_welcome
-    u = get_user(target_id)
+    await aapprove_user(target_id)
+    await alog_admin_action(user.id, target_id, "approve", "User approved")
+    from database import aget_user, get_all_joined_users, aget_welcome
+    u = await aget_user(target_id)
     joined_users = get_all_joined_users()
-    welcome = get_welcome()
+    welcome = await aget_welcome()
     count = len(joined_users)
     text = welcome.format(name=u[2], username=u[1] or "N/A", count=count)
-    for uid in joined_users:
-        try:
-            await context.bot.send_message(uid, text)
-        except Exception:
-            pass
-    for admin in ADMINS:
-        if admin not in joined_users:
-            try:
-                await context.bot.send_message(admin, f"User {u[2]} (@{u[1]}) has been approved and joined the chat.")
-            except Exception:
-                pass
+    await broadcast_text(context.bot, joined_users, text, label="welcome")
+    await broadcast_text(
+        context.bot,
+        [admin for admin in ADMINS if admin not in joined_users],
+        f"User {u[2]} (@{u[1]}) has been approved and joined the chat.",
+        label="approval notice",
+    )
 
 async def reject(update, context):
     user = update.effective_user
@@ -381,12 +525,12 @@ async def reject(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /reject @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found or not pending.")
         return
-    reject_user(target_id)
-    log_admin_action(user.id, target_id, "reject", "User rejected")
+    await areject_user(target_id)
+    await alog_admin_action(user.id, target_id, "reject", "User rejected")
     await update.message.reply_text(f"User @{target_username or target_id} has been rejected.")
 
 async def pin(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -397,25 +541,39 @@ async def pin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.reply_to_message:
         await update.message.reply_text("Reply to the message you want to pin with /pin")
         return
-    reply_to_id = get_db_id_from_telegram(update.message.reply_to_message.message_id)
+    reply_to_id = await aget_db_id_from_telegram(user.id, update.message.reply_to_message.message_id)
     if not reply_to_id:
         await update.message.reply_text("Could not identify the message to pin.")
         return
-    set_pinned(reply_to_id)
-    msg = get_message_by_id(reply_to_id)
+    await aset_pinned(reply_to_id)
+    msg = await aget_message_by_id(reply_to_id)
     uname = msg[8] if msg[8] else "Unknown"
     pin_text = f"<b>Pinned by admin</b>:\n<b>{uname}</b>\n{msg[2]}"
-    joined_users = get_all_joined_users()
-    for uid in joined_users:
-        try:
-            mid = get_user_pinned_msg(uid)
-            if mid:
-                await context.bot.edit_message_text(pin_text, chat_id=uid, message_id=mid, parse_mode="HTML")
-            else:
-                sent = await context.bot.send_message(uid, pin_text, parse_mode="HTML")
-                set_user_pinned_msg(uid, sent.message_id)
-        except Exception:
-            pass
+    digest = pin_hash(pin_text)
+    pinned_ids = await aget_user_pinned_msgs()
+    saved = []
+
+    async def send(uid):
+        mid = pinned_ids.get(uid, (None, None))[0]
+        if mid:
+            try:
+                edited = await context.bot.edit_message_text(pin_text, chat_id=uid, message_id=mid, parse_mode="HTML")
+                saved.append((uid, mid, digest))
+                return edited
+            except BadRequest as e:
+                if "not modified" in e.message:
+                    saved.append((uid, mid, digest))
+                    return True
+                if "not found" not in e.message:
+                    raise
+        sent = await context.bot.send_message(uid, pin_text, parse_mode="HTML")
+        saved.append((uid, sent.message_id, digest))
+        return sent
+
+    # Members whose pinned copy already shows this text are skipped.
+    targets = [uid for uid in get_all_joined_users() if pinned_ids.get(uid, (None, None))[1] != digest]
+    await fan_out(targets, send, label="pin")
+    await asave_user_pinned_msgs(saved)
     await update.message.reply_text("Message pinned and updated for all users.")
 
 async def unpin(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -423,25 +581,23 @@ async def unpin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(user.id):
         await update.message.reply_text("Only admins can unpin.")
         return
-    clear_pinned()
-    from database import get_all_joined_users, get_user_pinned_msg, clear_all_user_pinned_msgs
-    users = get_all_joined_users()
-    for uid in users:
-        mid = get_user_pinned_msg(uid)
-        if mid:
-            try:
-                await context.bot.edit_message_text("No pinned message.", chat_id=uid, message_id=mid)
-            except Exception:
-                pass
-    clear_all_user_pinned_msgs()
+    await aclear_pinned()
+    joined = set(get_all_joined_users())
+    pinned_ids = {uid: row[0] for uid, row in (await aget_user_pinned_msgs()).items() if uid in joined and row[0]}
+
+    async def send(uid):
+        return await context.bot.edit_message_text("No pinned message.", chat_id=uid, message_id=pinned_ids[uid])
+
+    await fan_out(list(pinned_ids), send, label="unpin")
+    await aclear_all_user_pinned_msgs()
     await update.message.reply_text("Pinned message removed for all users.")
 
 async def pinned(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg_id = get_pinned()
+    msg_id = await aget_pinned()
     if not msg_id:
         await update.message.reply_text("No pinned message.")
         return
-    msg = get_message_by_id(msg_id)
+    msg = await aget_message_by_id(msg_id)
     if not msg:
         await update.message.reply_text("Pinned message not found.")
         return
@@ -457,14 +613,14 @@ async def setwelcome(update, context):
         await update.message.reply_text("Usage: /setwelcome <message text>")
         return
     text = " ".join(context.args)
-    set_welcome(text)
+    await aset_welcome(text)
     await update.message.reply_text("Welcome message updated.")
 
 async def auditlog(update, context):
     user = update.effective_user
     if not is_admin(user.id):
         return
-    logs = get_admin_log(limit=20)
+    logs = await aget_admin_log(limit=20)
     text = "<b>Last 20 Admin Actions:</b>\n"
     for l in logs:
         t = datetime.datetime.fromtimestamp(l[2]).strftime("%Y-%m-%d %H:%M")
@@ -478,11 +634,11 @@ async def modhistory(update, context):
     if not context.args:
         await update.message.reply_text("Usage: /modhistory @username")
         return
-    target_id, target_username = parse_user_arg(context.args[0])
+    target_id, target_username = await parse_user_arg(context.args[0])
     if not target_id:
         await update.message.reply_text(f"User {context.args[0]} not found.")
         return
-    logs = get_modhistory(target_id)
+    logs = await aget_modhistory(target_id)
     text = f"<b>Last {len(logs)} Moderation Actions for @{target_username or target_id}:</b>\n"
     for l in logs:
         t = datetime.datetime.fromtimestamp(l[2]).strftime("%Y-%m-%d %H:%M")
@@ -493,33 +649,86 @@ async def admins_list(update, context):
     user = update.effective_user
     if not is_admin(user.id):
         return
-    admins = get_all_admins()
+    admins = await aget_all_admins()
     text = "<b>Admins:</b>\n"
     for a in admins:
         text += f"\n{a[1]} (<code>{a[0]}</code>)"
     await update.message.reply_html(text)
 
 async def members(update, context):
-    users = get_all_joined_users()
-    count = len(users)
+    count = count_joined_users()
     await update.message.reply_text(f"Current chat members: {count}")
 
 async def status(update, context):
-    users = get_all_joined_users()
-    pendings = get_all_pending_users()
     text = (
         f"Bot is running.\n"
-        f"Members: {len(users)}\n"
-        f"Pending approvals: {len(pendings)}\n"
+        f"Members: {count_joined_users()}\n"
+        f"Pending approvals: {count_pending_users()}\n"
+        f"Dormant (unreachable): {count_dormant_users()}\n"
+        f"Delivery queue: {delivery.depth()} pending sends\n"
+        f"Send rate: {send_controller.rate:.1f} msg/s ({send_controller.throttled} throttled)\n"
     )
+    if RECENT_BROADCASTS:
+        text += f"Last broadcast: {RECENT_BROADCASTS[-1]}\n"
+    stages = [
+        f"{name} {calls}/{verdicts}/{seconds / calls * 1000:.2f}"
+        for name, (calls, verdicts, seconds) in STAGE_STATS.items() if calls
+    ]
+    if stages:
+        text += "Moderation (checked/stopped/avg ms): " + ", ".join(stages) + "\n"
     await update.message.reply_text(text)
 
+async def block(update, context):
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+    if len(context.args) < 2 or context.args[0] not in KINDS:
+        await update.message.reply_text("Usage: /block domain|keyword|invite <pattern>")
+        return
+    kind = context.args[0]
+    if len(" ".join(context.args[1:])) > MAX_PATTERN_LENGTH:
+        await update.message.reply_text(f"Patterns are limited to {MAX_PATTERN_LENGTH} characters.")
+        return
+    pattern = await aadd_rule(kind, " ".join(context.args[1:]))
+    if not pattern:
+        await update.message.reply_text("Already blocked.")
+        return
+    await alog_admin_action(user.id, 0, "block", f"{kind}: {pattern}")
+    await update.message.reply_text(f"Blocked {kind}: {pattern}")
+
+async def unblock(update, context):
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+    if len(context.args) < 2 or context.args[0] not in KINDS:
+        await update.message.reply_text("Usage: /unblock domain|keyword|invite <pattern>")
+        return
+    kind = context.args[0]
+    pattern = await aremove_rule(kind, " ".join(context.args[1:]))
+    if not pattern:
+        await update.message.reply_text("No such rule.")
+        return
+    await alog_admin_action(user.id, 0, "unblock", f"{kind}: {pattern}")
+    await update.message.reply_text(f"Unblocked {kind}: {pattern}")
+
+async def blocklist(update, context):
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+    rules = await alist_rules()
+    if not rules:
+        await update.message.reply_text("Blocklist is empty.")
+        return
+    lines = [f"{kind}: <code>{html.escape(pattern)}</code>" for kind, pattern in rules]
+    text = "<b>Blocklist:</b>\n" + "\n".join(lines)
+    await update.message.reply_html(text[:4000])
+
 async def togglelinks(update, context):
     user = update.effective_user
     if not is_admin(user.id):
         return
     current = get_toggle("ban_links")
-    set_toggle("ban_links", 0 if current else 1)
+    await aset_toggle("ban_links", 0 if current else 1)
     await update.message.reply_text(f"Ban links is now {'ON' if not current else 'OFF'}.")
 
 async def togglemedia(update, context):
@@ -527,7 +736,7 @@ async def togglemedia(update, context):
     if not is_admin(user.id):
         return
     current = get_toggle("ban_media")
-    set_toggle("ban_media", 0 if current else 1)
+    await aset_toggle("ban_media", 0 if current else 1)
     await update.message.reply_text(f"Ban media is now {'ON' if not current else 'OFF'}.")
 
 def register_admin_handlers(app):
@@ -554,7 +763,13 @@ def register_admin_handlers(app):
     app.add_handler(CommandHandler("admins", admins_list))
     app.add_handler(CommandHandler("members", members))
     app.add_handler(CommandHandler("users", users_list))
+    app.add_handler(CallbackQueryHandler(users_page_button, pattern=r"^users:"))
+    app.add_handler(CommandHandler("search", search))
+    app.add_handler(CallbackQueryHandler(search_page_button, pattern=r"^search:"))
     app.add_handler(CommandHandler("status", status))
     app.add_handler(CommandHandler("togglelinks", togglelinks))
     app.add_handler(CommandHandler("togglemedia", togglemedia))
+    app.add_handler(CommandHandler("block", block))
+    app.add_handler(CommandHandler("unblock", unblock))
+    app.add_handler(CommandHandler("blocklist", blocklist))
 
@@ -1,60 +1,322 @@
+import random
+import re
 import time
-from database import warn_user, mute_user, ban_user, log_admin_action, get_user
-from utils import is_admin
+from collections import OrderedDict, deque
+from database import peek_gate_state, aget_gate_state, awarn_user, aban_user, alog_admin_action
+from config import ADMINS, WARN_THRESHOLD
+from content_filter import scan_content
+from fanout import delivery
+from metrics import Snapshot
 
 # --- Flood/Spam Detection ---
       #Modify to your spec 
-FLOOD_WINDOW = 6      # seconds
+MIN_INTERVAL = 1.5    # seconds between two messages from one user
+FLOOD_WINDOW = 8      # seconds
 FLOOD_LIMIT = 4       # messages per window
 DUP_WINDOW = 15       # seconds
-WARN_LIMIT = 3        # warnings before auto-mute
-BAN_LIMIT = 5         # warnings before auto-ban
-
-USER_MSG_TIMES = {}   
-USER_LAST_MSG = {}    
-
-def check_flood(user_id):
-    now = time.time()
-    if user_id not in USER_MSG_TIMES:
-        USER_MSG_TIMES[user_id] = []
-    USER_MSG_TIMES[user_id] = [t for t in USER_MSG_TIMES[user_id] if now - t < FLOOD_WINDOW]
-    USER_MSG_TIMES[user_id].append(now)
-    return len(USER_MSG_TIMES[user_id]) > FLOOD_LIMIT
-
-def check_duplicate(user_id, text):
-    now = time.time()
-    last = USER_LAST_MSG.get(user_id)
-    USER_LAST_MSG[user_id] = (text, now)
-    if not last:
-        return False
-    last_text, last_time = last
-    return text == last_text and (now - last_time < DUP_WINDOW)
+IDLE_EVICT = 600      # forget users idle for this many seconds
+MAX_TRACKED_USERS = 20000
+NEAR_DUP_WINDOW = 300     # seconds a message stays in the cross-user index
+NEAR_DUP_SENDERS = 3      # distinct senders of near-identical text = raid
+NEAR_DUP_SIMILARITY = 0.75 # estimated Jaccard similarity to count as the same
+NEAR_DUP_MIN_LENGTH = 20  # shorter texts are never compared
+NEAR_DUP_CAPACITY = 5000  # messages kept in the index
 
-async def handle_anti_spam(update, context):
-    user = update.effective_user
-    if is_admin(user.id):
-        return False  
-    msg_text = update.message.text or update.message.caption or ""
-    flood = check_flood(user.id)
-    duplicate = check_duplicate(user.id, msg_text)
-    user_db = get_user(user.id)
-    warns = user_db[6] if user_db else 0
-
-    if flood or duplicate:
-        warn_user(user.id)
-        log_admin_action(0, user.id, "autowarn", f"Flood/dup: {msg_text[:20]}")
-        await update.message.reply_text("⚠️ Spam detected. You have been warned!")
-        warns += 1
-        if warns == WARN_LIMIT:
-            mute_user(user.id, int(time.time()) + 3600)
-            log_admin_action(0, user.id, "automute", "Auto-muted (3 warns)")
-            await update.message.reply_text("🔇 Auto-muted for 1 hour (3 warnings).")
-        elif warns == BAN_LIMIT:
-            ban_user(user.id, int(time.time()) + 86400)
-            log_admin_action(0, user.id, "autoban", "Auto-banned (5 warns)")
-            await update.message.reply_text("⛔ Auto-banned for 24 hours (5 warnings).")
-        return True  
-    return False  
+VERDICT_REPLIES = {
+    "slow": "🛑 Slow down!",
+    "flood": "🛑 Slow down! Too many messages.",
+    "duplicate": "🛑 Please don't repeat the same message.",
+    "raid": "🛑 This message looks like spam and was not sent.",
+}
+
+class RatePolicy:
+    __slots__ = ("min_interval", "flood_window", "flood_limit", "dup_window", "idle_evict", "max_users")
+
+    def __init__(self, min_interval=MIN_INTERVAL, flood_window=FLOOD_WINDOW, flood_limit=FLOOD_LIMIT,
+                 dup_window=DUP_WINDOW, idle_evict=IDLE_EVICT, max_users=MAX_TRACKED_USERS):
+        self.min_interval = min_interval
+        self.flood_window = flood_window
+        self.flood_limit = flood_limit
+        self.dup_window = dup_window
+        self.idle_evict = idle_evict
+        self.max_users = max_users
+
+class UserWindow:
+    # Ring of the last flood_limit message times: the slot about to be
+    # overwritten is the message flood_limit messages ago, so a flood check
+    # is a single comparison.
+    __slots__ = ("times", "pos", "last_time", "last_hash", "last_hash_time")
+
+    def __init__(self, size):
+        self.times = [float("-inf")] * size
+        self.pos = 0
+        self.last_time = float("-inf")
+        self.last_hash = None
+        self.last_hash_time = float("-inf")
+
+class RateLimiter:
+    def __init__(self, policy):
+        self.policy = policy
+        self.users = OrderedDict()
+
+    def _evict(self, now):
+        users = self.users
+        cutoff = now - self.policy.idle_evict
+        while users:
+            oldest = next(iter(users.values()))
+            if oldest.last_time >= cutoff and len(users) < self.policy.max_users:
+                break
+            users.popitem(last=False)
+
+    def _window(self, user_id, now):
+        w = self.users.get(user_id)
+        if w is None:
+            self._evict(now)
+            w = self.users[user_id] = UserWindow(self.policy.flood_limit)
+        else:
+            self.users.move_to_end(user_id)
+        return w
+
+    def check(self, user_id, text=None):
+        p = self.policy
+        now = time.monotonic()
+        w = self._window(user_id, now)
+        if now - w.last_time < p.min_interval:
+            return "slow"
+        oldest = w.times[w.pos]
+        w.times[w.pos] = now
+        w.pos = (w.pos + 1) % len(w.times)
+        w.last_time = now
+        if now - oldest < p.flood_window:
+            return "flood"
+        if text:
+            h = hash(text)
+            duplicate = h == w.last_hash and now - w.last_hash_time < p.dup_window
+            w.last_hash = h
+            w.last_hash_time = now
+            if duplicate:
+                return "duplicate"
+        return None
+
+rate_limiter = RateLimiter(RatePolicy())
+
+def check_rate(user_id, text=None):
+    return rate_limiter.check(user_id, text)
+
+# --- Cross-account near-duplicates ---
+# MinHash signatures of character shingles, indexed with LSH bands: two texts
+# with Jaccard similarity s share a band with probability 1 - (1 - s^ROWS)^BANDS,
+# so a lookup only scans a few bounded buckets instead of every recent message.
+# Only texts that advertise something (a link, invite or @handle) are compared:
+# members echoing "good morning everyone" must never count as a raid.
+
+SHINGLE = 4
+MAX_SCAN_CHARS = 512
+NUM_HASHES = 16
+ROWS = 2                  # hashes per band -> NUM_HASHES // ROWS bands
+BUCKET_LIMIT = 64
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5eed)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(_PRIME)) for _ in range(NUM_HASHES)]
+_NON_WORD = re.compile(r"[\W_]+")
+_PROMO_RE = re.compile(
+    r"https?://|www\.|t\.me/|telegram\.(?:me|dog)/|@\w{5,}|\b[\w-]+\.(?:com|net|org|io|me|xyz|ru|top|app|link|gg)\b",
+    re.IGNORECASE,
+)
+
+def minhash(text):
+    text = _NON_WORD.sub(" ", text[:MAX_SCAN_CHARS].lower()).strip()
+    shingles = {hash(text[i:i + SHINGLE]) for i in range(max(1, len(text) - SHINGLE + 1))}
+    return tuple(min((a * h + b) % _PRIME for h in shingles) for a, b in _PERMS)
+
+def _band_keys(sig):
+    return [(i, sig[i:i + ROWS]) for i in range(0, NUM_HASHES, ROWS)]
+
+def _similarity(sig, other):
+    return sum(x == y for x, y in zip(sig, other)) / NUM_HASHES
+
+class NearDupIndex:
+    def __init__(self, window=NEAR_DUP_WINDOW, capacity=NEAR_DUP_CAPACITY,
+                 similarity=NEAR_DUP_SIMILARITY, senders=NEAR_DUP_SENDERS):
+        self.window = window
+        self.capacity = capacity
+        self.similarity = similarity
+        self.senders = senders
+        self.entries = deque()
+        self.buckets = {}
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        while self.entries and (self.entries[0][0] < cutoff or len(self.entries) >= self.capacity):
+            entry = self.entries.popleft()
+            for key in _band_keys(entry[1]):
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    continue
+                try:
+                    bucket.remove(entry)
+                except ValueError:
+                    pass
+                if not bucket:
+                    del self.buckets[key]
+
+    def check(self, user_id, text):
+        if not text or len(text) < NEAR_DUP_MIN_LENGTH or not _PROMO_RE.search(text):
+            return False
+        now = time.monotonic()
+        self._expire(now)
+        sig = minhash(text)
+        senders = {user_id}
+        entry = (now, sig, user_id)
+        for key in _band_keys(sig):
+            bucket = self.buckets.setdefault(key, deque(maxlen=BUCKET_LIMIT))
+            for _, other, uid in bucket:
+                if uid not in senders and _similarity(sig, other) >= self.similarity:
+                    senders.add(uid)
+            bucket.append(entry)
+        self.entries.append(entry)
+        return len(senders) >= self.senders
 
+near_dups = NearDupIndex()
 
+def check_raid(user_id, text):
+    return near_dups.check(user_id, text)
 
+# --- Moderation pipeline ---
+# Ordered stages, cheapest first; the first stage to return a verdict ends the
+# run. Each stage lists the message kinds it applies to, so stickers skip the
+# text scans. STAGE_STATS holds [calls, verdicts, seconds] per stage, shown in
+# /status and the metrics. Only content filter hits warn (and auto-ban at
+# WARN_THRESHOLD); rate limit and raid verdicts just reject the message, since
+# ordinary chat can trip them.
+
+class Verdict:
+    __slots__ = ("stage", "reply", "warn", "delete")
+
+    def __init__(self, stage, reply=None, warn=False, delete=False):
+        self.stage = stage
+        self.reply = reply
+        self.warn = warn
+        self.delete = delete
+
+ALLOW = Verdict("allow")
+
+class Check:
+    __slots__ = ("user_id", "kind", "text", "fingerprint", "gate")
+
+    def __init__(self, user_id, kind, text, fingerprint):
+        self.user_id = user_id
+        self.kind = kind
+        self.text = text
+        self.fingerprint = fingerprint
+        self.gate = None
+
+BLOCK_REASONS = {
+    "link": "Links are not allowed!",
+    "domain": "Links to that site are not allowed!",
+    "keyword": "That word is not allowed!",
+    "invite": "Invite links are not allowed!",
+    "media": "Media is not allowed!",
+    "sticker": "Stickers are not allowed!",
+}
+
+async def admin_stage(check):
+    return ALLOW if check.user_id in ADMINS else None
+
+async def gate_stage(check):
+    gate = check.gate = peek_gate_state(check.user_id) or await aget_gate_state(check.user_id)
+    text_reply = check.kind == "text"
+    if not gate.joined or gate.pending:
+        return Verdict("gate", "You are not approved to chat. Use /join." if text_reply else None)
+    now = int(time.time())
+    if gate.banned_until and gate.banned_until > now:
+        return Verdict("gate", "You are banned." if text_reply else None)
+    if gate.muted_until and gate.muted_until > now:
+        return Verdict("gate", "You are muted." if text_reply else None)
+    return None
+
+async def room_mode_stage(check):
+    text_reply = check.kind == "text"
+    if check.gate.lockdown:
+        return Verdict("room_mode", "🚨 Chatroom is in lockdown. Only admins can send messages." if text_reply else None)
+    if check.gate.silent:
+        return Verdict("room_mode", "🔕 Silent mode is on. Only admins may speak." if text_reply else None)
+    return None
+
+async def backpressure_stage(check):
+    if delivery.backlogged():
+        return Verdict("backpressure", "🐢 Chat is busy, slow mode is on. Please send that again in a moment.")
+    return None
+
+async def rate_limit_stage(check):
+    verdict = check_rate(check.user_id, check.fingerprint)
+    if verdict:
+        return Verdict("rate_limit", VERDICT_REPLIES[verdict])
+    return None
+
+async def content_stage(check):
+    if check.kind != "text" and check.gate.ban_media:
+        return Verdict("content", BLOCK_REASONS[check.kind], warn=True, delete=True)
+    hit = scan_content(check.text, links=check.gate.ban_links)
+    if hit:
+        return Verdict("content", BLOCK_REASONS[hit[0]], warn=True, delete=check.kind != "text")
+    return None
+
+async def duplicate_stage(check):
+    if check_raid(check.user_id, check.text):
+        return Verdict("duplicate", VERDICT_REPLIES["raid"])
+    return None
+
+STAGES = [
+    ("admin", admin_stage, {"text", "media", "sticker"}),
+    ("gate", gate_stage, {"text", "media", "sticker"}),
+    ("room_mode", room_mode_stage, {"text", "media", "sticker"}),
+    ("backpressure", backpressure_stage, {"text", "media", "sticker"}),
+    ("rate_limit", rate_limit_stage, {"text", "media", "sticker"}),
+    ("content", content_stage, {"text", "media", "sticker"}),
+    ("duplicate", duplicate_stage, {"text", "media"}),
+]
+STAGE_STATS = {name: [0, 0, 0.0] for name, _, _ in STAGES}
+
+Snapshot("chatbot_moderation_checks_total", "Messages checked per moderation stage.", "counter", ("stage",),
+         lambda: {(name,): s[0] for name, s in STAGE_STATS.items()})
+Snapshot("chatbot_moderation_verdicts_total", "Messages stopped per moderation stage.", "counter", ("stage",),
+         lambda: {(name,): s[1] for name, s in STAGE_STATS.items()})
+Snapshot("chatbot_moderation_seconds_total", "Time spent per moderation stage.", "counter", ("stage",),
+         lambda: {(name,): s[2] for name, s in STAGE_STATS.items()})
+
+async def run_stages(check):
+    for name, stage, kinds in STAGES:
+        if check.kind not in kinds:
+            continue
+        started = time.perf_counter()
+        verdict = await stage(check)
+        stats = STAGE_STATS[name]
+        stats[0] += 1
+        stats[2] += time.perf_counter() - started
+        if verdict:
+            stats[1] += 1
+            return verdict
+    return ALLOW
+
+async def moderate(update, kind, text=None, fingerprint=None):
+    # Returns True when the message was stopped and must not be broadcast.
+    user = update.effective_user
+    verdict = await run_stages(Check(user.id, kind, text, fingerprint or text))
+    if verdict is ALLOW:
+        return False
+    reply = verdict.reply
+    if verdict.warn:
+        warns = await awarn_user(user.id)
+        await alog_admin_action(0, user.id, "autowarn", f"{verdict.stage}: {(text or kind)[:20]}")
+        if warns >= WARN_THRESHOLD:
+            await aban_user(user.id)
+            await alog_admin_action(0, user.id, "autoban", f"Auto-banned at {warns} warns")
+            reply = f"{reply} You have been auto-banned."
+        else:
+            reply = f"{reply} Warned ({warns}/{WARN_THRESHOLD})."
+    if reply:
+        await update.message.reply_text(reply)
+    if verdict.delete:
+        await update.message.delete()
+    return True
@@ -0,0 +1,139 @@
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import re
+from config import ARCHIVE_DIR, ARCHIVE_BATCH
+from database import get_expired_messages, delete_archived_messages
+
+# Cold storage: messages older than ARCHIVE_AFTER_DAYS are appended to one gzip
+# JSONL file per table and month (archive/messages-2024-05.jsonl.gz) and then
+# deleted from the hot database. Each batch is written and fsynced before the
+# rows are deleted, so a crash can at worst write a batch twice; readers drop
+# repeated ids. Archived messages are only read when /history or /search ask.
+# The admin log stays in the database: /modhistory and /auditlog read it.
+
+MESSAGE_FIELDS = ("id", "user_id", "username", "name", "content", "media_type", "media_id", "reply_to", "timestamp")
+TABLES = {
+    "messages": (MESSAGE_FIELDS, get_expired_messages, delete_archived_messages),
+}
+_FILE_RE = re.compile(r"^(messages)-(\d{4}-\d{2})\.jsonl\.gz$")
+
+def month_of(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m")
+
+def archive_path(table, month):
+    return os.path.join(ARCHIVE_DIR, f"{table}-{month}.jsonl.gz")
+
+def archive_months(table):
+    # Archived months for a table, newest first.
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    months = [m.group(2) for m in map(_FILE_RE.match, os.listdir(ARCHIVE_DIR)) if m and m.group(1) == table]
+    return sorted(months, reverse=True)
+
+def _append(path, records):
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="ab") as gz:
+            gz.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode())
+        raw.flush()
+        os.fsync(raw.fileno())
+
+def archive_batch(table, before_ts, limit=ARCHIVE_BATCH):
+    # Moves up to `limit` rows older than before_ts; returns how many moved.
+    fields, fetch, delete = TABLES[table]
+    rows = fetch(before_ts, limit)
+    if not rows:
+        return 0
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(month_of(row[-1]), []).append(dict(zip(fields, row)))
+    for month, records in by_month.items():
+        _append(archive_path(table, month), records)
+    delete([row[0] for row in rows])
+    return len(rows)
+
+def read_month(table, month):
+    # Records of one archived month, oldest first, without repeated ids.
+    path = archive_path(table, month)
+    if not os.path.exists(path):
+        return []
+    seen = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            seen[record["id"]] = record
+    return sorted(seen.values(), key=lambda r: r["id"])
+
+def _message_row(record):
+    return tuple(record[f] for f in MESSAGE_FIELDS)
+
+def get_archived_messages(before_id=None, after_id=None, limit=20):
+    # Same rows and order as database.get_messages, read from the archive:
+    # the newest `limit` archived messages older than before_id, or the
+    # oldest `limit` newer than after_id.
+    if after_id is not None:
+        found = []
+        for month in archive_months("messages"):
+            records = read_month("messages", month)
+            found = [r for r in records if r["id"] > after_id] + found
+            if records and records[0]["id"] <= after_id:
+                break
+        return [_message_row(r) for r in found[:limit]]
+    found = []
+    for month in archive_months("messages"):
+        records = [r for r in read_month("messages", month) if before_id is None or r["id"] < before_id]
+        found = records[-(limit - len(found)):] + found
+        if len(found) >= limit:
+            break
+    return [_message_row(r) for r in found]
+
+def _snippet(text, pattern, width=120):
+    match = pattern.search(text)
+    start = max(0, match.start() - width // 3) if match else 0
+    snippet = ("…" if start else "") + text[start:start + width] + ("…" if start + width < len(text) else "")
+    return pattern.sub(lambda m: f"\x02{m.group(0)}\x03", snippet)
+
+def search_archive(terms, user_id=None, since=None, until=None, offset=0, limit=10):
+    # Same result shape as database.search_messages: every term must appear
+    # (a trailing * matches a prefix); newest first, months outside
+    # since/until are not opened.
+    checks = [
+        re.compile(r"(?<!\w)" + re.escape(t.rstrip("*")) + ("" if t.endswith("*") else r"(?!\w)"), re.IGNORECASE)
+        for t in terms if t.rstrip("*")
+    ]
+    if not checks:
+        return [], False
+    highlight = re.compile("|".join(c.pattern for c in checks), re.IGNORECASE)
+    first = month_of(since) if since is not None else None
+    last = month_of(until - 1) if until is not None else None
+    hits = []
+    for month in archive_months("messages"):
+        if (last and month > last) or (first and month < first):
+            continue
+        for record in reversed(read_month("messages", month)):
+            text = record["content"] or ""
+            if user_id is not None and record["user_id"] != user_id:
+                continue
+            if (since is not None and record["timestamp"] < since) or (until is not None and record["timestamp"] >= until):
+                continue
+            if all(c.search(text) for c in checks):
+                hits.append(record)
+                if len(hits) > offset + limit:
+                    break
+        if len(hits) > offset + limit:
+            break
+    page = hits[offset:offset + limit]
+    rows = [
+        (r["id"], r["user_id"], r["username"], r["name"], _snippet(r["content"] or "", highlight), r["timestamp"])
+        for r in page
+    ]
+    return rows, len(hits) > offset + limit
+
+async def aget_archived_messages(before_id=None, after_id=None, limit=20):
+    return await asyncio.to_thread(get_archived_messages, before_id, after_id, limit)
+
+async def asearch_archive(terms, **filters):
+    return await asyncio.to_thread(search_archive, terms, **filters)
@@ -1,36 +1,128 @@
 import nest_asyncio
 nest_asyncio.apply()
 import asyncio
+import logging
+import secrets
+import time
 from telegram.ext import ApplicationBuilder
-from config import BOT_TOKEN, AUTO_POSTS
-from database import init_db, get_all_joined_users
+from config import (
+    BOT_TOKEN, AUTO_POSTS, MAP_FLUSH_INTERVAL, MAP_RETENTION_DAYS, MAP_PRUNE_BATCH,
+    MAP_PRUNE_INTERVAL, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_CERT, WEBHOOK_KEY, MAX_CONCURRENT_UPDATES, FTS_BACKFILL_BATCH,
+    FTS_BACKFILL_PAUSE, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH, ARCHIVE_INTERVAL, METRICS_HOST, METRICS_PORT
+)
+from database import (
+    init_db, close_db, get_all_joined_users, aflush_telegram_map, aprune_telegram_map,
+    abackfill_messages_fts, run_db, db_queue_depth, map_buffer_depth
+)
+from metrics import Gauge, instrument_handlers, start_metrics_server
+from archive import TABLES as ARCHIVE_TABLES, archive_batch
+from content_filter import get_filter
+from updates import PerUserUpdateProcessor
+from fanout import delivery, broadcast_text, send_controller
 from handlers.admin import register_admin_handlers
 from handlers.user import register_user_handlers
-from handlers.chat import register_chat_handlers
+from handlers.chat import register_chat_handlers, render_message
+from handlers.system import register_system_handlers
+
+logging.basicConfig(
+    format="%(asctime)s %(name)s %(levelname)s %(message)s", level=logging.INFO
+)
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 init_db()
+get_filter()
 
 async def autopost_loop(app):
     if not AUTO_POSTS:
         return
-    from telegram.error import TelegramError
     while True:
         for post in AUTO_POSTS:
-            users = get_all_joined_users()
-            for uid in users:
-                try:
-                    await app.bot.send_message(uid, post["text"])
-                except TelegramError:
-                    pass
+            await broadcast_text(app.bot, get_all_joined_users(), post["text"], label="autopost")
             await asyncio.sleep(post.get("interval_minutes", 60) * 60)
 
+async def map_flush_loop():
+    while True:
+        await asyncio.sleep(MAP_FLUSH_INTERVAL)
+        await aflush_telegram_map()
+
+async def map_prune_loop():
+    if not MAP_RETENTION_DAYS:
+        return
+    while True:
+        cutoff = int(time.time()) - MAP_RETENTION_DAYS * 86400
+        while await aprune_telegram_map(cutoff, MAP_PRUNE_BATCH) == MAP_PRUNE_BATCH:
+            await asyncio.sleep(1)
+        await asyncio.sleep(MAP_PRUNE_INTERVAL)
+
+async def fts_backfill_loop():
+    while await abackfill_messages_fts(FTS_BACKFILL_BATCH):
+        await asyncio.sleep(FTS_BACKFILL_PAUSE)
+
+async def archive_loop():
+    if not ARCHIVE_AFTER_DAYS:
+        return
+    while True:
+        cutoff = int(time.time()) - ARCHIVE_AFTER_DAYS * 86400
+        for table in ARCHIVE_TABLES:
+            while await run_db(archive_batch, table, cutoff, ARCHIVE_BATCH) == ARCHIVE_BATCH:
+                await asyncio.sleep(1)
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+def register_gauges(app):
+    Gauge("chatbot_delivery_pending", "Outbox sends not yet attempted.", delivery.depth)
+    Gauge("chatbot_delivery_queued", "Sends claimed and waiting in shard queues.",
+          lambda: sum(q.qsize() for q in delivery.shards))
+    Gauge("chatbot_updates_queued", "Updates fetched but not yet dispatched.", app.update_queue.qsize)
+    Gauge("chatbot_updates_pending", "Updates being handled or waiting for their user's turn.",
+          app.update_processor.pending)
+    Gauge("chatbot_db_queue", "Calls waiting for the database thread.", db_queue_depth)
+    Gauge("chatbot_map_buffer", "Message map and outbox rows waiting to be flushed.", map_buffer_depth)
+    Gauge("chatbot_send_rate", "Current send rate limit (msgs/sec).", lambda: send_controller.rate)
+
+BACKGROUND_TASKS = []
+
+async def on_shutdown(app):
+    # Stop everything that still queues DB work before the DB thread goes.
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    await asyncio.gather(*BACKGROUND_TASKS, return_exceptions=True)
+    await delivery.stop()
+    close_db()
+
 async def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     register_admin_handlers(app)
     register_user_handlers(app)
     register_chat_handlers(app)
-    asyncio.create_task(autopost_loop(app))
-    await app.run_polling()
+    register_system_handlers(app)
+    instrument_handlers(app)
+    register_gauges(app)
+    delivery.start(lambda msg_id: render_message(app.bot, msg_id))
+    BACKGROUND_TASKS.extend(asyncio.create_task(loop) for loop in (
+        autopost_loop(app), map_flush_loop(), map_prune_loop(), fts_backfill_loop(), archive_loop()
+    ))
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    if WEBHOOK_URL:
+        await app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or secrets.token_urlsafe(32),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            cert=WEBHOOK_CERT,
+            key=WEBHOOK_KEY,
+        )
+    else:
+        await app.run_polling()
 
 if __name__ == "__main__":
     asyncio.run(main())
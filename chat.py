@@ -1,22 +1,33 @@
-from telegram import Update
-from telegram.ext import MessageHandler, filters, ContextTypes
-import re
 import datetime
+import html
+from telegram import Update
+from telegram.ext import CommandHandler, MessageHandler, filters, ContextTypes
 from database import (
-    add_message, get_message_by_id, get_all_joined_users, get_user,
-    is_joined, is_pending, get_toggle, warn_user, ban_user, reset_warns, map_telegram_to_db,
-    get_db_id_from_telegram
+    aadd_message, aget_message_by_id, get_all_joined_users, aget_db_id_from_telegram, aget_messages,
+    get_archived_through
 )
-from database import is_vendor
-from config import ADMINS, WARN_THRESHOLD
+from database import is_vendor, is_joined
+from fanout import delivery, deliver, finish, BroadcastStats
+from archive import aget_archived_messages
+from handlers.anti_spam import moderate
 
-def has_link(text):
-    return bool(re.search(r'https?://|www\.', text or ""))
+async def send_media(bot, uid, media_type, media_id, text):
+    if media_id and media_type == "photo":
+        return await bot.send_photo(uid, media_id, caption=text, parse_mode="HTML")
+    elif media_id and media_type == "video":
+        return await bot.send_video(uid, media_id, caption=text, parse_mode="HTML")
+    elif media_id and media_type == "animation":
+        return await bot.send_animation(uid, media_id, caption=text, parse_mode="HTML")
+    elif media_id and media_type == "sticker":
+        return await bot.send_sticker(uid, media_id)
+    elif media_id and media_type == "voice":
+        return await bot.send_voice(uid, media_id, caption=text, parse_mode="HTML")
+    return await bot.send_message(uid, text, parse_mode="HTML")
 
-async def broadcast_new_message(context, msg_id):
-    msg = get_message_by_id(msg_id)
+async def render_message(bot, msg_id):
+    msg = await aget_message_by_id(msg_id)
     if not msg:
-        return
+        return None
     
     uname = msg[8] or msg[3] or "Unknown"
     body = msg[2] or ""
@@ -28,7 +39,7 @@ async def broadcast_new_message(context, msg_id):
 
     
     if msg[5]:
-        rep = get_message_by_id(msg[5])
+        rep = await aget_message_by_id(msg[5])
         if rep:
             reply_type = rep[3]
             # Smart reply preview
@@ -49,136 +60,151 @@ async def broadcast_new_message(context, msg_id):
             text += f"\n<blockquote>↪ {rep[8] or 'Unknown'}: {preview}</blockquote>"
     text += f"\n{body}"
 
-    joined_users = get_all_joined_users()
-    for uid in joined_users:
-        try:
-            sent = None
-            if msg[4] and msg[3] == "photo":
-                sent = await context.bot.send_photo(uid, msg[4], caption=text, parse_mode="HTML")
-            elif msg[4] and msg[3] == "video":
-                sent = await context.bot.send_video(uid, msg[4], caption=text, parse_mode="HTML")
-            elif msg[4] and msg[3] == "animation":
-                sent = await context.bot.send_animation(uid, msg[4], caption=text, parse_mode="HTML")
-            elif msg[4] and msg[3] == "sticker":
-                sent = await context.bot.send_sticker(uid, msg[4])
-            elif msg[4] and msg[3] == "voice":
-                sent = await context.bot.send_voice(uid, msg[4], caption=text, parse_mode="HTML")
-            else:
-                sent = await context.bot.send_message(uid, text, parse_mode="HTML")
-            if sent:
-                map_telegram_to_db(sent.message_id, msg[0], uid)
-        except Exception:
-            pass
-
-user_last_msg_time = {}
-
-def check_spam(user_id):
-    now = datetime.datetime.now().timestamp()
-    last = user_last_msg_time.get(user_id, 0)
-    if now - last < 1.5:
-        return True
-    user_last_msg_time[user_id] = now
-    return False
+    async def send(uid):
+        return await send_media(bot, uid, msg[3], msg[4], text)
+
+    return send
+
+async def post_message(user_id, body, msg_type, file_id, reply_to):
+    # The message and its outbox rows are written together, so a restart
+    # resumes delivery instead of losing it.
+    recipients = get_all_joined_users()
+    msg_id = await aadd_message(user_id, body, msg_type, file_id, reply_to, recipients)
+    delivery.notify(len(recipients))
+    return msg_id
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if user.id in ADMINS:
-        pass
-    else:
-        if check_spam(user.id):
-            await update.message.reply_text("🛑 Slow down!")
-            return
-        if not is_joined(user.id) or is_pending(user.id):
-            await update.message.reply_text("You are not approved to chat. Use /join.")
-            return
-        u = get_user(user.id)
-        now = int(datetime.datetime.now().timestamp())
-        if u[4] and u[4] > now:
-            await update.message.reply_text("You are banned.")
-            return
-        if u[5] and u[5] > now:
-            await update.message.reply_text("You are muted.")
-            return
-        if get_toggle("ban_links") and has_link(update.message.text):
-            warns = warn_user(user.id)
-            if warns >= WARN_THRESHOLD:
-                ban_user(user.id)
-                await update.message.reply_text(f"Links are not allowed! You have been auto-banned.")
-            else:
-                await update.message.reply_text(f"Links are not allowed! Warned ({warns}/{WARN_THRESHOLD}).")
-            return
-
+    if await moderate(update, "text", update.message.text):
+        return
     reply_to = None
     if update.message.reply_to_message:
-        reply_to = get_db_id_from_telegram(update.message.reply_to_message.message_id)
-    msg_id = add_message(user.id, update.message.text, "text", None, reply_to)
+        reply_to = await aget_db_id_from_telegram(user.id, update.message.reply_to_message.message_id)
+    await post_message(user.id, update.message.text, "text", None, reply_to)
     await update.message.delete()
-    context.application.create_task(broadcast_new_message(context, msg_id))
 
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if user.id in ADMINS:
-        pass
-    else:
-        if not is_joined(user.id) or is_pending(user.id):
-            return
-        if get_toggle("ban_media"):
-            warns = warn_user(user.id)
-            if warns >= WARN_THRESHOLD:
-                ban_user(user.id)
-                await update.message.reply_text(f"Media is not allowed! You have been auto-banned.")
-            else:
-                await update.message.reply_text(f"Media is not allowed! Warned ({warns}/{WARN_THRESHOLD}).")
-            await update.message.delete()
-            return
-    media_type, media_id, caption = None, None, update.message.caption or ""
+    media_type, media, caption = None, None, update.message.caption or ""
     if update.message.photo:
         media_type = "photo"
-        media_id = update.message.photo[-1].file_id
+        media = update.message.photo[-1]
     elif update.message.video:
         media_type = "video"
-        media_id = update.message.video.file_id
+        media = update.message.video
     elif update.message.voice:
         media_type = "voice"
-        media_id = update.message.voice.file_id
+        media = update.message.voice
     elif update.message.animation:
         media_type = "animation"
-        media_id = update.message.animation.file_id
+        media = update.message.animation
     else:
         return
+    if await moderate(update, "media", caption, fingerprint=caption or media.file_unique_id):
+        return
     reply_to = None
     if update.message.reply_to_message:
-        reply_to = get_db_id_from_telegram(update.message.reply_to_message.message_id)
-    msg_id = add_message(user.id, caption, media_type, media_id, reply_to)
+        reply_to = await aget_db_id_from_telegram(user.id, update.message.reply_to_message.message_id)
+    await post_message(user.id, caption, media_type, media.file_id, reply_to)
     await update.message.delete()
-    context.application.create_task(broadcast_new_message(context, msg_id))
 
 async def handle_sticker(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if user.id in ADMINS:
-        pass
-    else:
-        if not is_joined(user.id) or is_pending(user.id):
-            return
-        if get_toggle("ban_media"):
-            warns = warn_user(user.id)
-            if warns >= WARN_THRESHOLD:
-                ban_user(user.id)
-                await update.message.reply_text(f"Stickers are not allowed! You have been auto-banned.")
-            else:
-                await update.message.reply_text(f"Stickers are not allowed! Warned ({warns}/{WARN_THRESHOLD}).")
-            await update.message.delete()
-            return
-    media_type = "sticker"
-    media_id = update.message.sticker.file_id
+    sticker = update.message.sticker
+    if await moderate(update, "sticker", fingerprint=sticker.file_unique_id):
+        return
     reply_to = None
     if update.message.reply_to_message:
-        reply_to = get_db_id_from_telegram(update.message.reply_to_message.message_id)
-    msg_id = add_message(user.id, "", media_type, media_id, reply_to)
+        reply_to = await aget_db_id_from_telegram(user.id, update.message.reply_to_message.message_id)
+    await post_message(user.id, "", "sticker", sticker.file_id, reply_to)
     await update.message.delete()
-    context.application.create_task(broadcast_new_message(context, msg_id))
+
+HISTORY_PAGE = 20
+HISTORY_MAX = 100
+HISTORY_BATCH_CHARS = 3500   # text lines packed into one message, under Telegram's 4096
+HISTORY_CAPTION_CHARS = 1024 # Telegram's caption limit
+
+def clip(text, limit):
+    # Telegram counts UTF-16 code units, so emoji take two.
+    if len(text.encode("utf-16-le")) <= limit * 2:
+        return text
+    text = text[:limit - 1]
+    while len(text.encode("utf-16-le")) > (limit - 1) * 2:
+        text = text[:-1]
+    return text + "…"
+
+def history_batches(rows):
+    # Consecutive text messages are packed into one HTML message; media goes
+    # out on its own with a caption. Yields (media_type, media_id, text).
+    lines = []
+    size = 0
+    for msg_id, user_id, username, name, content, media_type, media_id, reply_to, ts in rows:
+        when = datetime.datetime.fromtimestamp(ts).strftime("%m-%d %H:%M")
+        body = content or (f"[{media_type.title()}]" if media_type != "text" else "")
+        name = name or username or "Unknown"
+        media = media_id and media_type not in ("text", "sticker")
+        # Clipped before escaping, so an entity like &amp; is never cut; the
+        # limits count the visible text, not the tags.
+        prefix = len(f"{when} {name}: ".encode("utf-16-le")) // 2
+        room = (HISTORY_CAPTION_CHARS if media else HISTORY_BATCH_CHARS) - prefix
+        line = f"<i>{when}</i> <b>{html.escape(name)}</b>: {html.escape(clip(body, room))}"
+        if media:
+            if lines:
+                yield None, None, "\n".join(lines)
+                lines, size = [], 0
+            yield media_type, media_id, line
+            continue
+        if lines and size + len(line) > HISTORY_BATCH_CHARS:
+            yield None, None, "\n".join(lines)
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line) + 1
+    if lines:
+        yield None, None, "\n".join(lines)
+
+def merge_pages(*pages):
+    # Database and archive rows of one page, by id without repeats.
+    return sorted({row[0]: row for page in pages for row in page}.values(), key=lambda row: row[0])
+
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /history [count] replays the latest messages; /history older and
+    # /history newer page from the last replay using message id cursors.
+    # Pages at or below the newest archived id are merged with the archive.
+    user = update.effective_user
+    if not is_joined(user.id):
+        await update.message.reply_text("You are not in the chatroom. Use /join.")
+        return
+    arg = context.args[0].lower() if context.args else ""
+    shown = context.user_data.get("history")
+    if arg in ("older", "newer") and not shown:
+        await update.message.reply_text("Use /history first.")
+        return
+    archived_through = get_archived_through()
+    if arg == "older":
+        rows = await aget_messages(before_id=shown[0], limit=HISTORY_PAGE)
+        if archived_through and (len(rows) < HISTORY_PAGE or rows[0][0] <= archived_through):
+            archived = await aget_archived_messages(before_id=shown[0], limit=HISTORY_PAGE)
+            rows = merge_pages(rows, archived)[-HISTORY_PAGE:]
+    elif arg == "newer":
+        rows = await aget_messages(after_id=shown[1], limit=HISTORY_PAGE)
+        if shown[1] < archived_through:
+            archived = await aget_archived_messages(after_id=shown[1], limit=HISTORY_PAGE)
+            rows = merge_pages(rows, archived)[:HISTORY_PAGE]
+    else:
+        limit = min(int(arg), HISTORY_MAX) if arg.isdigit() and int(arg) > 0 else HISTORY_PAGE
+        rows = await aget_messages(limit=limit)
+    if not rows:
+        await update.message.reply_text("No more messages.")
+        return
+    context.user_data["history"] = (rows[0][0], rows[-1][0])
+    batches = list(history_batches(rows))
+    stats = BroadcastStats(f"history {user.id}", len(batches))
+    for media_type, media_id, text in batches:
+        await deliver(stats, user.id, lambda uid: send_media(context.bot, uid, media_type, media_id, text))
+    finish(stats)
 
 def register_chat_handlers(app):
+    app.add_handler(CommandHandler("history", history))
     app.add_handler(MessageHandler(
         filters.PHOTO | filters.VIDEO | filters.VOICE | filters.ANIMATION,
         handle_media
@@ -18,3 +18,80 @@ AUTO_POSTS = [
 
 WARN_THRESHOLD = 3
 
+
+# Broadcast fan-out: concurrent sends, global bot rate (msgs/sec, Telegram
+# allows ~30) and minimum seconds between two messages to the same chat.
+BROADCAST_CONCURRENCY = 20
+SEND_RATE = 30
+PER_CHAT_INTERVAL = 1.0
+
+# Adaptive send rate: SEND_RATE is the ceiling. A RetryAfter from Telegram
+# multiplies the rate by SEND_RATE_BACKOFF (never below SEND_RATE_MIN); each
+# second without one adds SEND_RATE_STEP back. Timeouts and network errors
+# are retried SEND_RETRIES times, backing off from SEND_RETRY_BASE seconds.
+SEND_RATE_MIN = 3
+SEND_RATE_STEP = 1.0
+SEND_RATE_BACKOFF = 0.5
+SEND_RETRIES = 3
+SEND_RETRY_BASE = 1.0
+# Consecutive "blocked / chat not found" failures before a member is marked
+# dormant and skipped by broadcasts (undone when they message the bot).
+DORMANT_AFTER = 3
+
+# telegram_map write-behind: rows per executemany and max seconds buffered.
+MAP_BATCH_SIZE = 500
+MAP_FLUSH_INTERVAL = 2.0
+
+# telegram_map retention: mappings older than this many days are pruned in
+# batches every MAP_PRUNE_INTERVAL seconds (None keeps them forever).
+MAP_RETENTION_DAYS = 30
+MAP_PRUNE_BATCH = 1000
+MAP_PRUNE_INTERVAL = 3600
+
+# Per-user moderation state cached for the chat gate (seconds, max users).
+GATE_CACHE_TTL = 60
+GATE_CACHE_SIZE = 10000
+
+# Webhook mode: set WEBHOOK_URL to the public https base URL Telegram should
+# post to and the bot serves updates on WEBHOOK_LISTEN:WEBHOOK_PORT instead of
+# long polling. Leave WEBHOOK_CERT/WEBHOOK_KEY as None when TLS is terminated
+# by a reverse proxy in front of the bot.
+WEBHOOK_URL = None
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+WEBHOOK_SECRET = None
+WEBHOOK_MAX_CONNECTIONS = 40
+WEBHOOK_CERT = None
+WEBHOOK_KEY = None
+
+# Updates handled at once; updates from the same user always stay in order.
+MAX_CONCURRENT_UPDATES = 64
+
+# Chat message delivery: recipients are spread over DELIVERY_SHARDS ordered
+# queues. When more than DELIVERY_BACKLOG_LIMIT sends are waiting, members
+# get a slow-mode reply instead of having their message accepted.
+DELIVERY_SHARDS = 20
+DELIVERY_QUEUE_SIZE = 10000
+DELIVERY_BACKLOG_LIMIT = 50000
+OUTBOX_CLAIM_BATCH = 500
+
+# Full-text search: the one-time index backfill of existing messages runs in
+# chunks of FTS_BACKFILL_BATCH ids with a pause between chunks.
+FTS_BACKFILL_BATCH = 2000
+FTS_BACKFILL_PAUSE = 0.2
+# /search ranks only the newest SEARCH_RANK_WINDOW matches of a query, which
+# keeps very common words fast on large histories.
+SEARCH_RANK_WINDOW = 2000
+
+# Cold storage: messages older than ARCHIVE_AFTER_DAYS are moved to gzip JSONL
+# files in ARCHIVE_DIR, one per month (0 disables).
+ARCHIVE_AFTER_DAYS = 0
+ARCHIVE_DIR = "archive"
+ARCHIVE_BATCH = 1000
+ARCHIVE_INTERVAL = 86400
+
+# Prometheus metrics at http://METRICS_HOST:METRICS_PORT/metrics
+# (None disables the endpoint).
+METRICS_PORT = None
+METRICS_HOST = "127.0.0.1"
@@ -0,0 +1,149 @@
+import logging
+import re
+from database import get_block_rules, aadd_block_rule, aremove_block_rule, aget_block_rules
+
+# Blocklist rules by kind. Each kind's patterns are kept in a character trie
+# that is rendered as one nested regex alternation, and all kinds are joined
+# into a single compiled pattern, so a scan is one regex pass whose cost does
+# not grow with the number of rules.
+KINDS = ("domain", "keyword", "invite")
+MAX_PATTERN_LENGTH = 200
+BOUNDARIES = {
+    "domain": (r"(?<![\w-])", r"(?![\w-])"),
+    "keyword": (r"(?<!\w)", r"(?!\w)"),
+    "invite": ("", ""),
+}
+LINK_RE = re.compile(r"https?://|www\.", re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+def normalize(kind, pattern):
+    pattern = pattern.strip().lower()
+    if kind == "domain":
+        pattern = re.sub(r"^[a-z]+://", "", pattern)
+        pattern = re.sub(r"^www\.", "", pattern).rstrip("/")
+    elif kind == "invite":
+        pattern = re.sub(r"^[a-z]+://", "", pattern)
+    return pattern
+
+def _trie_regex(root):
+    # Rendered bottom-up with an explicit stack: one level per character
+    # would hit the recursion limit on a long pattern.
+    rendered = {}
+    stack = [(root, False)]
+    while stack:
+        node, ready = stack.pop()
+        children = [(ch, child) for ch, child in sorted(node.items()) if ch]
+        if not ready:
+            stack.append((node, True))
+            stack.extend((child, False) for _, child in children)
+            continue
+        alts = [re.escape(ch) + rendered.pop(id(child)) for ch, child in children]
+        if not alts:
+            rendered[id(node)] = ""
+        elif len(alts) == 1 and "" not in node:
+            rendered[id(node)] = alts[0]
+        else:
+            rendered[id(node)] = "(?:" + "|".join(alts) + ")" + ("?" if "" in node else "")
+    return rendered[id(root)]
+
+class ContentFilter:
+    def __init__(self):
+        self.loaded = False
+        self.tries = {kind: {} for kind in KINDS}
+        self.counts = {kind: 0 for kind in KINDS}
+        self.parts = {kind: "" for kind in KINDS}
+        self.dirty = set()
+        self.regex = None
+
+    def load(self, rules):
+        for kind, pattern in rules:
+            self.add(kind, pattern)
+        self.loaded = True
+
+    def add(self, kind, pattern):
+        node = self.tries[kind]
+        for ch in pattern:
+            node = node.setdefault(ch, {})
+        if "" not in node:
+            node[""] = True
+            self.counts[kind] += 1
+            self.dirty.add(kind)
+
+    def remove(self, kind, pattern):
+        path = [self.tries[kind]]
+        for ch in pattern:
+            node = path[-1].get(ch)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].pop("", None) is None:
+            return
+        for ch, node in zip(reversed(pattern), reversed(path[:-1])):
+            if node[ch]:
+                break
+            del node[ch]
+        self.counts[kind] -= 1
+        self.dirty.add(kind)
+
+    def _compile(self):
+        # Only kinds whose trie changed are re-rendered. If that fails the
+        # last good pattern stays in use, so a bad rule cannot stop the chat.
+        parts = dict(self.parts)
+        try:
+            for kind in self.dirty:
+                body = _trie_regex(self.tries[kind])
+                before, after = BOUNDARIES[kind]
+                parts[kind] = f"(?P<{kind}>{before}{body}{after})" if body else ""
+            combined = "|".join(part for part in parts.values() if part)
+            regex = re.compile(combined) if combined else None
+        except (re.error, RecursionError):
+            logger.exception("Could not compile the blocklist, keeping the previous one")
+        else:
+            self.parts = parts
+            self.regex = regex
+        self.dirty.clear()
+
+    def scan(self, text, links=False):
+        if not text:
+            return None
+        if self.dirty:
+            self._compile()
+        if self.regex:
+            m = self.regex.search(text.lower())
+            if m:
+                return m.lastgroup, m.group()
+        if links:
+            m = LINK_RE.search(text)
+            if m:
+                return "link", m.group()
+        return None
+
+content_filter = ContentFilter()
+
+def get_filter():
+    if not content_filter.loaded:
+        content_filter.load(get_block_rules())
+    return content_filter
+
+def scan_content(text, links=False):
+    return get_filter().scan(text, links)
+
+# The rule table is written on the DB thread; the compiled filter is only
+# changed here, on the event loop that scans with it.
+async def aadd_rule(kind, pattern):
+    pattern = normalize(kind, pattern)
+    if not pattern or not await aadd_block_rule(kind, pattern):
+        return None
+    get_filter().add(kind, pattern)
+    return pattern
+
+async def aremove_rule(kind, pattern):
+    pattern = normalize(kind, pattern)
+    if not await aremove_block_rule(kind, pattern):
+        return None
+    get_filter().remove(kind, pattern)
+    return pattern
+
+async def alist_rules():
+    return await aget_block_rules()
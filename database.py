@@ -1,80 +1,309 @@
 import sqlite3
 import datetime
-from config import ADMINS, DEFAULT_WELCOME, WARN_THRESHOLD
+import asyncio
+import functools
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from metrics import DB_SECONDS
+from config import (
+    ADMINS, DEFAULT_WELCOME, WARN_THRESHOLD, MAP_BATCH_SIZE, MAP_PRUNE_BATCH,
+    GATE_CACHE_TTL, GATE_CACHE_SIZE, FTS_BACKFILL_BATCH, SEARCH_RANK_WINDOW
+)
+
 
 DB_PATH = "chatroom.db"
 
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+)
+
+# One long-lived connection per thread: the event loop thread for the few
+# remaining sync callers, and the single DB executor thread for everything
+# awaited through the a* functions at the bottom of this file.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+def connect():
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(DB_PATH, check_same_thread=False)
+        for pragma in PRAGMAS:
+            con.execute(pragma)
+        _local.con = con
+        with _connections_lock:
+            _connections.append(con)
+    return con
+
+def close_db():
+    _executor.shutdown(wait=True)
+    flush_telegram_map()
+    with _connections_lock:
+        for con in _connections:
+            con.close()
+        _connections.clear()
+    _local.con = None
+
+async def run_db(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+def db_queue_depth():
+    return _executor._work_queue.qsize()
+
+def _awaitable(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with DB_SECONDS.time(fn.__name__):
+            return await run_db(fn, *args, **kwargs)
+    wrapper.__name__ = "a" + fn.__name__
+    return wrapper
+
+def _create_base_schema(con):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        name TEXT,
+        is_admin INTEGER DEFAULT 0,
+        banned_until INTEGER,
+        muted_until INTEGER,
+        warns INTEGER DEFAULT 0,
+        joined INTEGER DEFAULT 0,
+        join_time INTEGER,
+        pending INTEGER DEFAULT 0,
+        is_vendor INTEGER DEFAULT 0
+    )""")
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        content TEXT,
+        media_type TEXT,
+        media_id TEXT,
+        reply_to INTEGER,
+        timestamp INTEGER
+    )""")
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS adminlog (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER,
+        target_id INTEGER,
+        action TEXT,
+        details TEXT,
+        timestamp INTEGER
+    )""")
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS telegram_map (
+        telegram_message_id INTEGER,
+        db_message_id INTEGER,
+        user_id INTEGER
+    )""")
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS pinned (msg_id INTEGER)
+    """)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS user_pinned_msgs (
+        user_id INTEGER PRIMARY KEY,
+        telegram_message_id INTEGER
+    )
+    """)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS toggles (
+        key TEXT PRIMARY KEY,
+        value INTEGER
+    )
+    """)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS welcome_msg (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        text TEXT
+    )
+    """)
+    con.execute("INSERT OR IGNORE INTO toggles (key, value) VALUES ('ban_links', 0)")
+    con.execute("INSERT OR IGNORE INTO toggles (key, value) VALUES ('ban_media', 0)")
+    con.execute("INSERT OR IGNORE INTO welcome_msg (id, text) VALUES (1, ?)", (DEFAULT_WELCOME,))
+
+def _add_vendor_column(con):
+    columns = {row[1] for row in con.execute("PRAGMA table_info(users)")}
+    if "is_vendor" not in columns:
+        con.execute("ALTER TABLE users ADD COLUMN is_vendor INTEGER DEFAULT 0")
+
+def _create_name_history(con):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS name_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        name TEXT,
+        username TEXT,
+        timestamp INTEGER
+    )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_name_history_user ON name_history (user_id, id)")
+
+def _add_hot_path_indexes(con):
+    con.execute("CREATE INDEX IF NOT EXISTS idx_telegram_map_tg ON telegram_map (telegram_message_id, db_message_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_telegram_map_db ON telegram_map (db_message_id, user_id, telegram_message_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_adminlog_target ON adminlog (target_id, timestamp)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_adminlog_timestamp ON adminlog (timestamp)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)")
+
+def _rebuild_telegram_map(con):
+    # Telegram message ids are only unique within a chat, so the map is keyed
+    # by (user_id, telegram_message_id) and stamped for retention pruning.
+    con.execute("""
+    CREATE TABLE telegram_map_new (
+        user_id INTEGER NOT NULL,
+        telegram_message_id INTEGER NOT NULL,
+        db_message_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL,
+        PRIMARY KEY (user_id, telegram_message_id)
+    ) WITHOUT ROWID""")
+    con.execute("""
+    INSERT OR REPLACE INTO telegram_map_new (user_id, telegram_message_id, db_message_id, created_at)
+    SELECT t.user_id, t.telegram_message_id, t.db_message_id,
+           COALESCE(m.timestamp, CAST(strftime('%s', 'now') AS INTEGER))
+    FROM telegram_map t LEFT JOIN messages m ON m.id = t.db_message_id
+    WHERE t.user_id IS NOT NULL AND t.telegram_message_id IS NOT NULL AND t.db_message_id IS NOT NULL
+    """)
+    con.execute("DROP TABLE telegram_map")
+    con.execute("ALTER TABLE telegram_map_new RENAME TO telegram_map")
+    con.execute("CREATE INDEX idx_telegram_map_db ON telegram_map (db_message_id)")
+    con.execute("CREATE INDEX idx_telegram_map_created ON telegram_map (created_at)")
+
+def _create_blocklist(con):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS blocklist (
+        kind TEXT NOT NULL,
+        pattern TEXT NOT NULL,
+        PRIMARY KEY (kind, pattern)
+    ) WITHOUT ROWID""")
+
+def _create_outbox(con):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        db_message_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        claimed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (db_message_id, user_id)
+    ) WITHOUT ROWID""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_outbox_claimed ON outbox (claimed, db_message_id, user_id)")
+
+def _add_dormant_column(con):
+    columns = {row[1] for row in con.execute("PRAGMA table_info(users)")}
+    if "dormant" not in columns:
+        con.execute("ALTER TABLE users ADD COLUMN dormant INTEGER DEFAULT 0")
+
+def _add_pinned_text_hash(con):
+    columns = {row[1] for row in con.execute("PRAGMA table_info(user_pinned_msgs)")}
+    if "text_hash" not in columns:
+        con.execute("ALTER TABLE user_pinned_msgs ADD COLUMN text_hash TEXT")
+
+def _create_messages_fts(con):
+    # External-content index over messages.content. Rows newer than the
+    # fts_backfill cursor are indexed by the triggers; older ones are added in
+    # chunks by backfill_messages_fts, newest first, and the delete/update
+    # triggers leave them alone until then.
+    con.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""")
+    pending = "COALESCE((SELECT value FROM toggles WHERE key='fts_backfill'), 0)"
+    con.execute("""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END""")
+    con.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages WHEN old.id > {pending} BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""")
+    con.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages WHEN old.id > {pending} BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END""")
+    last_id = con.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+    con.execute("INSERT OR REPLACE INTO toggles (key, value) VALUES ('fts_backfill', ?)", (last_id,))
+
+# Each migration runs once, in its own transaction, and bumps PRAGMA user_version.
+# Append new steps to the end; never renumber or edit one that has shipped.
+MIGRATIONS = [
+    (1, _create_base_schema),
+    (2, _add_vendor_column),
+    (3, _create_name_history),
+    (4, _add_hot_path_indexes),
+    (5, _rebuild_telegram_map),
+    (6, _create_blocklist),
+    (7, _create_outbox),
+    (8, _add_dormant_column),
+    (9, _add_pinned_text_hash),
+    (10, _create_messages_fts),
+]
+
 def init_db():
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            name TEXT,
-            is_admin INTEGER DEFAULT 0,
-            banned_until INTEGER,
-            muted_until INTEGER,
-            warns INTEGER DEFAULT 0,
-            joined INTEGER DEFAULT 0,
-            join_time INTEGER,
-            pending INTEGER DEFAULT 0,
-            is_vendor INTEGER DEFAULT 0
-        )""")
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            content TEXT,
-            media_type TEXT,
-            media_id TEXT,
-            reply_to INTEGER,
-            timestamp INTEGER
-        )""")
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS adminlog (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            admin_id INTEGER,
-            target_id INTEGER,
-            action TEXT,
-            details TEXT,
-            timestamp INTEGER
-        )""")
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS telegram_map (
-            telegram_message_id INTEGER,
-            db_message_id INTEGER,
-            user_id INTEGER
-        )""")
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS pinned (msg_id INTEGER)
-        """)
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS user_pinned_msgs (
-            user_id INTEGER PRIMARY KEY,
-            telegram_message_id INTEGER
-        )
-        """)
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS toggles (
-            key TEXT PRIMARY KEY,
-            value INTEGER
-        )
-        """)
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS welcome_msg (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            text TEXT
-        )
-        """)
-        con.execute("INSERT OR IGNORE INTO toggles (key, value) VALUES ('ban_links', 0)")
-        con.execute("INSERT OR IGNORE INTO toggles (key, value) VALUES ('ban_media', 0)")
-        con.execute("INSERT OR IGNORE INTO welcome_msg (id, text) VALUES (1, ?)", (DEFAULT_WELCOME,))
+    con = connect()
+    current = con.execute("PRAGMA user_version").fetchone()[0]
+    for version, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        with con:
+            con.execute("BEGIN")
+            migrate(con)
+            con.execute(f"PRAGMA user_version={version}")
+    roster()
+    settings()
+
+# ---- ROSTER CACHE ----
+# Joined/pending/vendor/admin id sets, loaded once and kept in step by every
+# write below, so membership checks and fan-outs never touch the users table.
+
+class Roster:
+    def __init__(self):
+        self.loaded = False
+        self.joined = set()
+        self.pending = set()
+        self.vendors = set()
+        self.admins = set()
+        self.dormant = set()
+
+    def load(self):
+        with connect() as con:
+            rows = con.execute(
+                "SELECT user_id, joined, pending, is_vendor, is_admin, dormant FROM users "
+                "WHERE joined=1 OR pending=1 OR is_vendor=1 OR is_admin=1 OR dormant=1"
+            ).fetchall()
+        self.joined = {r[0] for r in rows if r[1] == 1}
+        self.pending = {r[0] for r in rows if r[2] == 1}
+        self.vendors = {r[0] for r in rows if r[3] == 1}
+        self.admins = {r[0] for r in rows if r[4] == 1}
+        self.dormant = {r[0] for r in rows if r[5] == 1}
+        self.loaded = True
+
+    def set_membership(self, user_id, joined, pending):
+        (self.joined.add if joined else self.joined.discard)(user_id)
+        (self.pending.add if pending else self.pending.discard)(user_id)
+
+_roster = Roster()
+
+def roster():
+    if not _roster.loaded:
+        _roster.load()
+    return _roster
 
 def add_user(user_id, username, name, approval_mode=False):
     ts = int(datetime.datetime.now().timestamp())
     pending = 1 if approval_mode else 0
     joined = 0 if approval_mode else 1
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute(
             """
             INSERT INTO users (user_id, username, name, joined, join_time, pending)
@@ -83,187 +312,300 @@ def add_user(user_id, username, name, approval_mode=False):
                 username=excluded.username,
                 name=excluded.name,
                 joined=?,
-                pending=?
+                pending=?,
+                dormant=0
             """,
             (user_id, username, name, joined, ts, pending, joined, pending),
         )
+    roster().set_membership(user_id, joined, pending)
+    roster().dormant.discard(user_id)
 
 def approve_user(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("UPDATE users SET joined=1, pending=0 WHERE user_id=?", (user_id,))
+    with connect() as con:
+        cur = con.execute("UPDATE users SET joined=1, pending=0 WHERE user_id=?", (user_id,))
+    if cur.rowcount:
+        roster().set_membership(user_id, 1, 0)
 
 def reject_user(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("UPDATE users SET pending=0, joined=0 WHERE user_id=?", (user_id,))
+    with connect() as con:
+        cur = con.execute("UPDATE users SET pending=0, joined=0 WHERE user_id=?", (user_id,))
+    if cur.rowcount:
+        roster().set_membership(user_id, 0, 0)
 
 def remove_user(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("UPDATE users SET joined=0, pending=0 WHERE user_id=?", (user_id,))
+    with connect() as con:
+        cur = con.execute("UPDATE users SET joined=0, pending=0 WHERE user_id=?", (user_id,))
+    if cur.rowcount:
+        roster().set_membership(user_id, 0, 0)
 
 def is_joined(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        cur = con.execute("SELECT joined FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        return row and row[0] == 1
+    return user_id in roster().joined
 
 def is_pending(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        cur = con.execute("SELECT pending FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        return row and row[0] == 1
+    return user_id in roster().pending
 
 
 def set_admin(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("UPDATE users SET is_admin=1 WHERE user_id=?", (user_id,))
+    with connect() as con:
+        cur = con.execute("UPDATE users SET is_admin=1 WHERE user_id=?", (user_id,))
+    if cur.rowcount:
+        roster().admins.add(user_id)
 
 def remove_admin(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("UPDATE users SET is_admin=0 WHERE user_id=?", (user_id,))
+    with connect() as con:
+        cur = con.execute("UPDATE users SET is_admin=0 WHERE user_id=?", (user_id,))
+    if cur.rowcount:
+        roster().admins.discard(user_id)
 
 def is_admin(user_id):
     return int(user_id) in ADMINS
 
 def get_user(user_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
         return cur.fetchone()
 
 def get_user_by_username(username):
-    username = username.lstrip('@').lower()
-    with sqlite3.connect(DB_PATH) as con:
+    username = username.lstrip('@')
+    with connect() as con:
         cur = con.execute(
-            "SELECT * FROM users WHERE LOWER(username)=?", (username,))
+            "SELECT * FROM users WHERE username=? COLLATE NOCASE", (username,))
         return cur.fetchone()
 
 def get_all_joined_users():
-    with sqlite3.connect(DB_PATH) as con:
-        cur = con.execute("SELECT user_id FROM users WHERE joined=1")
-        return [row[0] for row in cur.fetchall()]
+    # Dormant members (bot blocked, account deleted) are skipped by fan-outs.
+    r = roster()
+    return list(r.joined - r.dormant)
+
+def count_joined_users():
+    return len(roster().joined)
+
+def count_dormant_users():
+    r = roster()
+    return len(r.joined & r.dormant)
+
+def is_dormant(user_id):
+    return user_id in roster().dormant
+
+def set_dormant(user_id, dormant):
+    with connect() as con:
+        cur = con.execute("UPDATE users SET dormant=? WHERE user_id=?", (1 if dormant else 0, user_id))
+    if cur.rowcount:
+        (roster().dormant.add if dormant else roster().dormant.discard)(user_id)
+
+def count_pending_users():
+    return len(roster().pending)
 
 def get_all_pending_users():
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute("SELECT user_id, username, name FROM users WHERE pending=1")
         return cur.fetchall()
 
 def get_all_admins():
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute("SELECT user_id, name FROM users WHERE is_admin=1")
         return cur.fetchall()
 
+# ---- GATE STATE ----
+# Everything the chat handlers need to admit a message: membership from the
+# roster, room modes from settings, and the user's moderation columns from one
+# query cached for GATE_CACHE_TTL seconds. Moderation writes below invalidate
+# the user's entry.
+
+GateState = namedtuple(
+    "GateState",
+    "joined pending banned_until muted_until warns ban_links ban_media lockdown silent"
+)
+
+_gate_users = {}
+
+def invalidate_gate_state(user_id):
+    _gate_users.pop(user_id, None)
+
+def peek_gate_state(user_id):
+    entry = _gate_users.get(user_id)
+    if not entry or entry[0] < time.monotonic():
+        return None
+    return _build_gate_state(user_id, entry[1])
+
+def get_gate_state(user_id):
+    cached = peek_gate_state(user_id)
+    if cached:
+        return cached
+    with connect() as con:
+        row = con.execute(
+            "SELECT banned_until, muted_until, warns FROM users WHERE user_id=?", (user_id,)
+        ).fetchone() or (None, None, 0)
+    now = time.monotonic()
+    if len(_gate_users) >= GATE_CACHE_SIZE:
+        for uid in [uid for uid, entry in _gate_users.items() if entry[0] < now]:
+            _gate_users.pop(uid, None)
+        if len(_gate_users) >= GATE_CACHE_SIZE:
+            _gate_users.clear()
+    _gate_users[user_id] = (now + GATE_CACHE_TTL, (row[0], row[1], row[2] or 0))
+    return _build_gate_state(user_id, _gate_users[user_id][1])
+
+def _build_gate_state(user_id, user_row):
+    r = roster()
+    s = settings()
+    return GateState(
+        user_id in r.joined, user_id in r.pending, *user_row,
+        s.get("ban_links") or 0, s.get("ban_media") or 0,
+        s.get("lockdown") or 0, s.get("silent") or 0,
+    )
+
 def ban_user(user_id):
     until_ts = int(datetime.datetime(2100, 1, 1).timestamp())
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("UPDATE users SET banned_until=? WHERE user_id=?", (until_ts, user_id))
+    invalidate_gate_state(user_id)
 
 def unban_user(user_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("UPDATE users SET banned_until=NULL WHERE user_id=?", (user_id,))
+    invalidate_gate_state(user_id)
 
 def mute_user(user_id, until_ts):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("UPDATE users SET muted_until=? WHERE user_id=?", (until_ts, user_id))
+    invalidate_gate_state(user_id)
 
 def unmute_user(user_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("UPDATE users SET muted_until=NULL WHERE user_id=?", (user_id,))
+    invalidate_gate_state(user_id)
 
 def warn_user(user_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("UPDATE users SET warns = warns + 1 WHERE user_id=?", (user_id,))
+    invalidate_gate_state(user_id)
     u = get_user(user_id)
     return u[6]
 
 def reset_warns(user_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("UPDATE users SET warns=0 WHERE user_id=?", (user_id,))
+    invalidate_gate_state(user_id)
 
 def get_warns(user_id):
     u = get_user(user_id)
     return u[6] if u else 0
 
 def kick_user(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("UPDATE users SET joined=0, pending=0 WHERE user_id=?", (user_id,))
+    with connect() as con:
+        cur = con.execute("UPDATE users SET joined=0, pending=0 WHERE user_id=?", (user_id,))
+    if cur.rowcount:
+        roster().set_membership(user_id, 0, 0)
 
 def set_welcome(text):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("INSERT OR REPLACE INTO welcome_msg (id, text) VALUES (1, ?)", (text,))
 
 def get_welcome():
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute("SELECT text FROM welcome_msg WHERE id=1")
         r = cur.fetchone()
         return r[0] if r else DEFAULT_WELCOME
 
 def set_pinned(msg_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("DELETE FROM pinned")
         con.execute("INSERT INTO pinned (msg_id) VALUES (?)", (msg_id,))
 
 def clear_pinned():
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("DELETE FROM pinned")
 
 def get_pinned():
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute("SELECT msg_id FROM pinned").fetchone()
         return cur[0] if cur else None
 
 def set_user_pinned_msg(user_id, telegram_message_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("INSERT OR REPLACE INTO user_pinned_msgs (user_id, telegram_message_id) VALUES (?, ?)", (user_id, telegram_message_id))
 
 def get_user_pinned_msg(user_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute("SELECT telegram_message_id FROM user_pinned_msgs WHERE user_id=?", (user_id,))
         r = cur.fetchone()
         return r[0] if r else None
 
+def get_user_pinned_msgs():
+    # {user_id: (telegram_message_id, text_hash)} for every member, in one query.
+    with connect() as con:
+        cur = con.execute("SELECT user_id, telegram_message_id, text_hash FROM user_pinned_msgs")
+        return {r[0]: (r[1], r[2]) for r in cur}
+
+def save_user_pinned_msgs(rows):
+    # rows: (user_id, telegram_message_id, text_hash)
+    with connect() as con:
+        con.executemany(
+            """
+            INSERT INTO user_pinned_msgs (user_id, telegram_message_id, text_hash) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                telegram_message_id=excluded.telegram_message_id,
+                text_hash=excluded.text_hash
+            """,
+            rows,
+        )
+
 def clear_all_user_pinned_msgs():
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("DELETE FROM user_pinned_msgs")
 
-def add_message(user_id, content, media_type, media_id, reply_to):
+def add_message(user_id, content, media_type, media_id, reply_to, recipients=()):
+    # The message and one outbox row per recipient are committed together, so
+    # a broadcast survives a restart (see fanout.DeliveryScheduler).
     ts = int(datetime.datetime.now().timestamp())
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute(
             "INSERT INTO messages (user_id, content, media_type, media_id, reply_to, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
             (user_id, content, media_type, media_id, reply_to, ts),
         )
-        return cur.lastrowid
+        msg_id = cur.lastrowid
+        con.executemany(
+            "INSERT OR IGNORE INTO outbox (db_message_id, user_id) VALUES (?, ?)",
+            [(msg_id, uid) for uid in recipients],
+        )
+        return msg_id
 
 def get_message_by_id(msg_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute(
             "SELECT m.*, u.username, u.name FROM messages m LEFT JOIN users u ON m.user_id = u.user_id WHERE m.id=?",
             (msg_id,))
         return cur.fetchone()
 
-def get_messages(offset=0, limit=20):
-    with sqlite3.connect(DB_PATH) as con:
-        cur = con.execute(
-            """
-            SELECT m.id, m.user_id, u.username, u.name, m.content, m.media_type, m.media_id, m.reply_to, m.timestamp
-            FROM messages m
-            LEFT JOIN users u ON m.user_id = u.user_id
-            ORDER BY m.timestamp ASC
-            LIMIT ? OFFSET ?
-            """, (limit, offset)
-        )
-        return cur.fetchall()
+def get_messages(before_id=None, after_id=None, limit=20):
+    # Keyset pages on messages.id, returned oldest first: the newest `limit`
+    # messages by default, older than before_id, or newer than after_id.
+    query = """
+        SELECT m.id, m.user_id, u.username, u.name, m.content, m.media_type, m.media_id, m.reply_to, m.timestamp
+        FROM messages m
+        LEFT JOIN users u ON m.user_id = u.user_id
+    """
+    with connect() as con:
+        if after_id is not None:
+            cur = con.execute(query + "WHERE m.id > ? ORDER BY m.id ASC LIMIT ?", (after_id, limit))
+            return cur.fetchall()
+        if before_id is not None:
+            cur = con.execute(query + "WHERE m.id < ? ORDER BY m.id DESC LIMIT ?", (before_id, limit))
+        else:
+            cur = con.execute(query + "ORDER BY m.id DESC LIMIT ?", (limit,))
+        return cur.fetchall()[::-1]
 
 def delete_message(msg_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute("DELETE FROM messages WHERE id=?", (msg_id,))
 
 def count_messages():
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute("SELECT COUNT(*) FROM messages")
         return cur.fetchone()[0]
 
 def get_last_messages(n=20):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute(
             """
             SELECT m.id, m.user_id, u.username, u.name, m.content, m.media_type, m.media_id, m.reply_to, m.timestamp
@@ -275,37 +617,224 @@ def get_last_messages(n=20):
         )
         return cur.fetchall()[::-1]
 
-def map_telegram_to_db(telegram_message_id, db_message_id, user_id):
-    with sqlite3.connect(DB_PATH) as con:
+def backfill_messages_fts(batch=FTS_BACKFILL_BATCH):
+    # Indexes the next `batch` ids below the cursor and moves it down, in one
+    # transaction. Returns the number of ids covered; 0 once the index is complete.
+    cursor = get_setting("fts_backfill", 0)
+    if cursor <= 0:
+        return 0
+    low = max(0, cursor - batch)
+    with connect() as con:
         con.execute(
-            "INSERT INTO telegram_map (telegram_message_id, db_message_id, user_id) VALUES (?, ?, ?)",
-            (telegram_message_id, db_message_id, user_id),
+            "INSERT INTO messages_fts (rowid, content) SELECT id, content FROM messages WHERE id > ? AND id <= ?",
+            (low, cursor),
+        )
+        con.execute("INSERT OR REPLACE INTO toggles (key, value) VALUES ('fts_backfill', ?)", (low,))
+    settings()["fts_backfill"] = low
+    return cursor - low
+
+def fts_query(terms):
+    # Every word becomes a quoted FTS5 string, so user input can never be a
+    # syntax error; a trailing * keeps prefix matching.
+    parts = []
+    for term in terms:
+        prefix = term.endswith("*")
+        term = term.rstrip("*")
+        if term:
+            parts.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(parts)
+
+def search_messages(terms, user_id=None, since=None, until=None, offset=0, limit=10):
+    # Ranked by bm25 among the newest SEARCH_RANK_WINDOW matches: FTS5 walks
+    # the match list in rowid order, so this stays fast even for terms that
+    # hit a large share of the table. Returns (rows, has_next); rows are
+    # (id, user_id, username, name, snippet, timestamp) and the snippet marks
+    # hits with \x02 ... \x03 for the caller to escape and highlight.
+    query = fts_query(terms)
+    if not query:
+        return [], False
+    where = ["messages_fts MATCH ?"]
+    params = [query]
+    if user_id is not None:
+        where.append("m.user_id = ?")
+        params.append(user_id)
+    # Ids grow with time, so date bounds also become rowid bounds the FTS
+    # scan can seek to instead of filtering row by row.
+    if since is not None:
+        where.append(
+            "messages_fts.rowid >= (SELECT id FROM messages WHERE timestamp >= ? ORDER BY timestamp, id LIMIT 1)"
+            " AND m.timestamp >= ?"
+        )
+        params += [since, since]
+    if until is not None:
+        where.append(
+            "messages_fts.rowid <= (SELECT id FROM messages WHERE timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT 1)"
+            " AND m.timestamp < ?"
         )
+        params += [until, until]
+    with connect() as con:
+        hits = con.execute(
+            f"""
+            SELECT id FROM (
+                SELECT messages_fts.rowid AS id, bm25(messages_fts) AS score
+                FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                WHERE {" AND ".join(where)}
+                ORDER BY messages_fts.rowid DESC
+                LIMIT ?
+            )
+            ORDER BY score, id DESC
+            LIMIT ? OFFSET ?
+            """,
+            params + [SEARCH_RANK_WINDOW, limit + 1, offset],
+        ).fetchall()
+        ids = [h[0] for h in hits[:limit]]
+        if not ids:
+            return [], False
+        marks = ", ".join("?" * len(ids))
+        found = {
+            r[0]: r for r in con.execute(
+                f"""
+                SELECT m.id, m.user_id, u.username, u.name,
+                       snippet(messages_fts, 0, char(2), char(3), '…', 16), m.timestamp
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                LEFT JOIN users u ON u.user_id = m.user_id
+                WHERE messages_fts MATCH ? AND messages_fts.rowid IN ({marks})
+                """,
+                [query] + ids,
+            )
+        }
+    return [found[i] for i in ids if i in found], len(hits) > limit
+
+# telegram_map rows are buffered and written with one executemany per batch
+# or per MAP_FLUSH_INTERVAL (see bot.map_flush_loop). The lock is held for
+# the whole flush so readers always find a row in either the buffer or the table.
+# The same flush deletes the outbox rows of every delivered (mapped) or
+# abandoned (finish_outbox) send, so delivery and mapping commit together.
+_map_buffer = []
+_outbox_done = []
+_map_lock = threading.Lock()
+
+def map_telegram_to_db(telegram_message_id, db_message_id, user_id):
+    ts = int(datetime.datetime.now().timestamp())
+    with _map_lock:
+        _map_buffer.append((user_id, telegram_message_id, db_message_id, ts))
+        full = len(_map_buffer) + len(_outbox_done) >= MAP_BATCH_SIZE
+    if full:
+        flush_telegram_map()
+
+def finish_outbox(db_message_id, user_id):
+    with _map_lock:
+        _outbox_done.append((db_message_id, user_id))
+        full = len(_map_buffer) + len(_outbox_done) >= MAP_BATCH_SIZE
+    if full:
+        flush_telegram_map()
 
-def get_db_id_from_telegram(telegram_message_id):
-    with sqlite3.connect(DB_PATH) as con:
+def flush_telegram_map():
+    with _map_lock:
+        if not _map_buffer and not _outbox_done:
+            return 0
+        with connect() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO telegram_map (user_id, telegram_message_id, db_message_id, created_at) VALUES (?, ?, ?, ?)",
+                _map_buffer,
+            )
+            con.executemany(
+                "DELETE FROM outbox WHERE db_message_id=? AND user_id=?",
+                [(db_id, uid) for uid, _, db_id, _ in _map_buffer] + _outbox_done,
+            )
+        count = len(_map_buffer) + len(_outbox_done)
+        _map_buffer.clear()
+        _outbox_done.clear()
+        return count
+
+def map_buffer_depth():
+    return len(_map_buffer) + len(_outbox_done)
+
+def get_db_id_from_telegram(user_id, telegram_message_id):
+    with _map_lock:
+        for uid, tg_id, db_id, _ in reversed(_map_buffer):
+            if tg_id == telegram_message_id and uid == user_id:
+                return db_id
+    with connect() as con:
         cur = con.execute(
-            "SELECT db_message_id FROM telegram_map WHERE telegram_message_id=?",
-            (telegram_message_id,)
+            "SELECT db_message_id FROM telegram_map WHERE user_id=? AND telegram_message_id=?",
+            (user_id, telegram_message_id)
         )
         row = cur.fetchone()
         return row[0] if row else None
 
 def get_telegram_message_ids_for_db_message(db_message_id):
-    with sqlite3.connect(DB_PATH) as con:
+    with _map_lock, connect() as con:
+        buffered = [(uid, tg_id) for uid, tg_id, db_id, _ in _map_buffer if db_id == db_message_id]
         cur = con.execute("SELECT user_id, telegram_message_id FROM telegram_map WHERE db_message_id=?", (db_message_id,))
-        return cur.fetchall()
+        return cur.fetchall() + buffered
+
+def purge_message(db_message_id):
+    # Deletes a message together with its telegram_map rows (stored and
+    # buffered) and its outbox rows in one transaction. Returns the
+    # (user_id, telegram_message_id) copies to remove from members' chats and
+    # how many unclaimed sends were dropped from the outbox.
+    with _map_lock:
+        with connect() as con:
+            copies = con.execute(
+                "SELECT user_id, telegram_message_id FROM telegram_map WHERE db_message_id=?", (db_message_id,)
+            ).fetchall()
+            con.execute("DELETE FROM telegram_map WHERE db_message_id=?", (db_message_id,))
+            unsent = con.execute("DELETE FROM outbox WHERE db_message_id=? AND claimed=0", (db_message_id,)).rowcount
+            con.execute("DELETE FROM outbox WHERE db_message_id=?", (db_message_id,))
+            con.execute("DELETE FROM messages WHERE id=?", (db_message_id,))
+        copies += [(uid, tg_id) for uid, tg_id, db_id, _ in _map_buffer if db_id == db_message_id]
+        _map_buffer[:] = [row for row in _map_buffer if row[2] != db_message_id]
+        _outbox_done[:] = [row for row in _outbox_done if row[0] != db_message_id]
+        return copies, unsent
+
+def claim_outbox(limit):
+    with connect() as con:
+        rows = con.execute(
+            "SELECT db_message_id, user_id FROM outbox WHERE claimed=0 ORDER BY db_message_id, user_id LIMIT ?",
+            (limit,)
+        ).fetchall()
+        con.executemany("UPDATE outbox SET claimed=1 WHERE db_message_id=? AND user_id=?", rows)
+        return rows
+
+def release_outbox(rows):
+    # Puts claimed (db_message_id, user_id) rows back for the next claim.
+    with connect() as con:
+        con.executemany("UPDATE outbox SET claimed=0 WHERE db_message_id=? AND user_id=?", rows)
+
+def reset_outbox_claims():
+    # Claimed rows whose send was not recorded before a restart are sent again.
+    with connect() as con:
+        con.execute("UPDATE outbox SET claimed=0 WHERE claimed=1")
+
+def count_outbox(db_message_id=None):
+    with connect() as con:
+        if db_message_id is None:
+            return con.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        return con.execute("SELECT COUNT(*) FROM outbox WHERE db_message_id=?", (db_message_id,)).fetchone()[0]
+
+def prune_telegram_map(older_than_ts, limit=MAP_PRUNE_BATCH):
+    with connect() as con:
+        cur = con.execute(
+            """
+            DELETE FROM telegram_map WHERE (user_id, telegram_message_id) IN (
+                SELECT user_id, telegram_message_id FROM telegram_map WHERE created_at < ? LIMIT ?
+            )
+            """, (older_than_ts, limit)
+        )
+        return cur.rowcount
 
 def log_admin_action(admin_id, target_id, action, details=""):
     ts = int(datetime.datetime.now().timestamp())
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         con.execute(
             "INSERT INTO adminlog (admin_id, target_id, action, details, timestamp) VALUES (?, ?, ?, ?, ?)",
             (admin_id, target_id, action, details, ts)
         )
 
 def get_admin_log(limit=20):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute(
             """
             SELECT a.action, a.details, a.timestamp, u.name
@@ -317,26 +846,78 @@ def get_admin_log(limit=20):
         return cur.fetchall()
 
 def get_modhistory(user_id, limit=20):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute(
             "SELECT action, details, timestamp FROM adminlog WHERE target_id=? ORDER BY timestamp DESC LIMIT ?",
             (user_id, limit)
         )
         return cur.fetchall()
 
+# ---- ARCHIVE ----
+# Messages older than ARCHIVE_AFTER_DAYS are copied to compressed files by
+# archive.py and then removed here; the pinned message is always kept.
+
+def get_expired_messages(before_ts, limit):
+    with connect() as con:
+        cur = con.execute(
+            """
+            SELECT m.id, m.user_id, u.username, u.name, m.content, m.media_type, m.media_id, m.reply_to, m.timestamp
+            FROM messages m
+            LEFT JOIN users u ON m.user_id = u.user_id
+            WHERE m.timestamp < ? AND m.id NOT IN (SELECT msg_id FROM pinned WHERE msg_id IS NOT NULL)
+            ORDER BY m.timestamp, m.id
+            LIMIT ?
+            """, (before_ts, limit)
+        )
+        return cur.fetchall()
+
+def delete_archived_messages(ids):
+    # Also records the newest archived id: history pages at or below it can
+    # have rows in the archive (pinned messages stay in the database).
+    rows = [(i,) for i in ids]
+    with connect() as con:
+        con.executemany("DELETE FROM telegram_map WHERE db_message_id=?", rows)
+        con.executemany("DELETE FROM outbox WHERE db_message_id=?", rows)
+        con.executemany("DELETE FROM messages WHERE id=?", rows)
+        newest = max(max(ids), get_archived_through())
+        con.execute("INSERT OR REPLACE INTO toggles (key, value) VALUES ('archived_through', ?)", (newest,))
+    settings()["archived_through"] = newest
+
+def get_archived_through():
+    return get_setting("archived_through", 0)
+
+# ---- SETTINGS ----
+# Toggles and room modes (lockdown, silent, pinned_notice) are loaded once and
+# served from memory; writes go through to the toggles table. pinned_notice is
+# text, which SQLite's flexible typing stores fine in the value column.
+
+_settings = None
+
+def settings():
+    global _settings
+    if _settings is None:
+        with connect() as con:
+            _settings = dict(con.execute("SELECT key, value FROM toggles").fetchall())
+    return _settings
+
+def get_setting(key, default=None):
+    value = settings().get(key)
+    return default if value is None else value
+
+def set_setting(key, value):
+    with connect() as con:
+        con.execute("INSERT OR REPLACE INTO toggles (key, value) VALUES (?, ?)", (key, value))
+    settings()[key] = value
+
 def get_toggle(key):
-    with sqlite3.connect(DB_PATH) as con:
-        cur = con.execute("SELECT value FROM toggles WHERE key=?", (key,))
-        r = cur.fetchone()
-        return r[0] if r else 0
+    return get_setting(key, 0)
 
 def set_toggle(key, value):
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("INSERT OR REPLACE INTO toggles (key, value) VALUES (?, ?)", (key, value))
+    set_setting(key, value)
 
 def add_name_history(user_id, name, username):
     ts = int(datetime.datetime.now().timestamp())
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         last = con.execute(
             "SELECT name, username FROM name_history WHERE user_id=? ORDER BY id DESC LIMIT 1",
             (user_id,)
@@ -348,30 +929,154 @@ def add_name_history(user_id, name, username):
             )
 
 def get_name_history(user_id, limit=20):
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute(
             "SELECT name, username, timestamp FROM name_history WHERE user_id=? ORDER BY id DESC LIMIT ?",
             (user_id, limit)
         )
         return cur.fetchall()
 
+# ---- BLOCKLIST ----
+
+def add_block_rule(kind, pattern):
+    with connect() as con:
+        cur = con.execute("INSERT OR IGNORE INTO blocklist (kind, pattern) VALUES (?, ?)", (kind, pattern))
+        return cur.rowcount > 0
+
+def remove_block_rule(kind, pattern):
+    with connect() as con:
+        cur = con.execute("DELETE FROM blocklist WHERE kind=? AND pattern=?", (kind, pattern))
+        return cur.rowcount > 0
+
+def get_block_rules():
+    with connect() as con:
+        return con.execute("SELECT kind, pattern FROM blocklist ORDER BY kind, pattern").fetchall()
+
 # ---- VENDOR ROLE ----
 
 def set_vendor(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("UPDATE users SET is_vendor=1 WHERE user_id=?", (user_id,))
+    with connect() as con:
+        cur = con.execute("UPDATE users SET is_vendor=1 WHERE user_id=?", (user_id,))
+    if cur.rowcount:
+        roster().vendors.add(user_id)
 
 def remove_vendor(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        con.execute("UPDATE users SET is_vendor=0 WHERE user_id=?", (user_id,))
+    with connect() as con:
+        cur = con.execute("UPDATE users SET is_vendor=0 WHERE user_id=?", (user_id,))
+    if cur.rowcount:
+        roster().vendors.discard(user_id)
 
 def is_vendor(user_id):
-    with sqlite3.connect(DB_PATH) as con:
-        r = con.execute("SELECT is_vendor FROM users WHERE user_id=?", (user_id,)).fetchone()
-        return r and r[0] == 1
+    return user_id in roster().vendors
 
 def get_all_vendors():
-    with sqlite3.connect(DB_PATH) as con:
+    with connect() as con:
         cur = con.execute("SELECT user_id, username, name FROM users WHERE is_vendor=1")
         return cur.fetchall()
 
+# Extra WHERE clauses for get_users_page; every page is a range scan on the
+# user_id primary key, so any page costs the same however large the room is.
+USER_FILTERS = {
+    "all": "",
+    "vendors": " AND is_vendor=1",
+    "warned": " AND warns>0",
+    "muted": " AND muted_until>:now",
+}
+
+def get_users_page(after=None, before=None, limit=50, filter="all"):
+    # Returns (rows, has_prev, has_next); rows are
+    # (user_id, username, name, is_vendor, warns, muted_until, dormant).
+    where = "joined=1" + USER_FILTERS[filter]
+    params = {"now": int(time.time()), "limit": limit + 1}
+    with connect() as con:
+        if before is not None:
+            params["cursor"] = before
+            rows = con.execute(
+                "SELECT user_id, username, name, is_vendor, warns, muted_until, dormant FROM users "
+                f"WHERE {where} AND user_id<:cursor ORDER BY user_id DESC LIMIT :limit",
+                params,
+            ).fetchall()
+            has_prev = len(rows) > limit
+            rows = rows[:limit][::-1]
+            has_next = True
+        else:
+            params["cursor"] = after if after is not None else -1 << 63
+            rows = con.execute(
+                "SELECT user_id, username, name, is_vendor, warns, muted_until, dormant FROM users "
+                f"WHERE {where} AND user_id>:cursor ORDER BY user_id LIMIT :limit",
+                params,
+            ).fetchall()
+            has_next = len(rows) > limit
+            rows = rows[:limit]
+            has_prev = after is not None
+        return rows, has_prev, has_next
+
+# ---- ASYNC API ----
+
+aadd_user = _awaitable(add_user)
+aapprove_user = _awaitable(approve_user)
+areject_user = _awaitable(reject_user)
+aremove_user = _awaitable(remove_user)
+ais_joined = _awaitable(is_joined)
+ais_pending = _awaitable(is_pending)
+aset_admin = _awaitable(set_admin)
+aremove_admin = _awaitable(remove_admin)
+aget_user = _awaitable(get_user)
+aget_user_by_username = _awaitable(get_user_by_username)
+aget_all_joined_users = _awaitable(get_all_joined_users)
+aget_users_page = _awaitable(get_users_page)
+aset_dormant = _awaitable(set_dormant)
+aget_all_pending_users = _awaitable(get_all_pending_users)
+aget_all_admins = _awaitable(get_all_admins)
+aget_gate_state = _awaitable(get_gate_state)
+aban_user = _awaitable(ban_user)
+aunban_user = _awaitable(unban_user)
+amute_user = _awaitable(mute_user)
+aunmute_user = _awaitable(unmute_user)
+awarn_user = _awaitable(warn_user)
+areset_warns = _awaitable(reset_warns)
+aget_warns = _awaitable(get_warns)
+akick_user = _awaitable(kick_user)
+aset_welcome = _awaitable(set_welcome)
+aget_welcome = _awaitable(get_welcome)
+aset_pinned = _awaitable(set_pinned)
+aclear_pinned = _awaitable(clear_pinned)
+aget_pinned = _awaitable(get_pinned)
+aset_user_pinned_msg = _awaitable(set_user_pinned_msg)
+aget_user_pinned_msg = _awaitable(get_user_pinned_msg)
+aclear_all_user_pinned_msgs = _awaitable(clear_all_user_pinned_msgs)
+aget_user_pinned_msgs = _awaitable(get_user_pinned_msgs)
+asave_user_pinned_msgs = _awaitable(save_user_pinned_msgs)
+aadd_message = _awaitable(add_message)
+aget_message_by_id = _awaitable(get_message_by_id)
+aget_messages = _awaitable(get_messages)
+adelete_message = _awaitable(delete_message)
+acount_messages = _awaitable(count_messages)
+aget_last_messages = _awaitable(get_last_messages)
+amap_telegram_to_db = _awaitable(map_telegram_to_db)
+aflush_telegram_map = _awaitable(flush_telegram_map)
+aprune_telegram_map = _awaitable(prune_telegram_map)
+afinish_outbox = _awaitable(finish_outbox)
+aclaim_outbox = _awaitable(claim_outbox)
+acount_outbox = _awaitable(count_outbox)
+arelease_outbox = _awaitable(release_outbox)
+aget_db_id_from_telegram = _awaitable(get_db_id_from_telegram)
+abackfill_messages_fts = _awaitable(backfill_messages_fts)
+asearch_messages = _awaitable(search_messages)
+aget_telegram_message_ids_for_db_message = _awaitable(get_telegram_message_ids_for_db_message)
+apurge_message = _awaitable(purge_message)
+alog_admin_action = _awaitable(log_admin_action)
+aget_admin_log = _awaitable(get_admin_log)
+aget_modhistory = _awaitable(get_modhistory)
+aget_toggle = _awaitable(get_toggle)
+aset_toggle = _awaitable(set_toggle)
+aset_setting = _awaitable(set_setting)
+aadd_name_history = _awaitable(add_name_history)
+aget_name_history = _awaitable(get_name_history)
+aset_vendor = _awaitable(set_vendor)
+aremove_vendor = _awaitable(remove_vendor)
+ais_vendor = _awaitable(is_vendor)
+aget_all_vendors = _awaitable(get_all_vendors)
+aadd_block_rule = _awaitable(add_block_rule)
+aremove_block_rule = _awaitable(remove_block_rule)
+aget_block_rules = _awaitable(get_block_rules)
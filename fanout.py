@@ -0,0 +1,373 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from config import (
+    BROADCAST_CONCURRENCY, SEND_RATE, PER_CHAT_INTERVAL, DELIVERY_SHARDS, DELIVERY_QUEUE_SIZE,
+    DELIVERY_BACKLOG_LIMIT, OUTBOX_CLAIM_BATCH, SEND_RATE_MIN, SEND_RATE_STEP, SEND_RATE_BACKOFF,
+    SEND_RETRIES, SEND_RETRY_BASE, DORMANT_AFTER
+)
+from metrics import BROADCAST_SECONDS, SEND_OUTCOMES
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from database import (
+    amap_telegram_to_db, afinish_outbox, aclaim_outbox, count_outbox,
+    reset_outbox_claims, arelease_outbox, aset_dormant
+)
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self, until):
+        # Nothing accrues before `until`, and at most a second's worth of
+        # sends can burst at the current rate afterwards.
+        self.tokens = 0
+        self.updated = max(self.updated, until)
+        self.capacity = max(1, self.rate)
+
+class ChatLimiter:
+    def __init__(self, interval, max_chats=10000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self.next_at = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        if len(self.next_at) > self.max_chats:
+            self.next_at = {c: t for c, t in self.next_at.items() if t > now}
+        slot = max(now, self.next_at.get(chat_id, 0))
+        self.next_at[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+class BroadcastStats:
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.duration = 0.0
+
+    @property
+    def done(self):
+        return self.delivered + self.failed >= self.total
+
+    @property
+    def throughput(self):
+        return self.delivered / self.duration if self.duration else 0.0
+
+    def finish(self):
+        self.duration = time.monotonic() - self.started
+
+    def __str__(self):
+        return (
+            f"{self.label}: {self.delivered}/{self.total} delivered, {self.retried} retried, "
+            f"{self.failed} failed in {self.duration:.2f}s ({self.throughput:.1f} msg/s)"
+        )
+
+class SendController:
+    # AIMD control of the shared token bucket: the rate creeps back up by
+    # SEND_RATE_STEP msgs/sec per second without throttling and is multiplied
+    # by SEND_RATE_BACKOFF on a RetryAfter. A RetryAfter also pauses every
+    # sender for the requested time, since Telegram's flood wait is bot-wide.
+    # Timeouts and network errors are retried with jittered exponential
+    # backoff; anything else (blocked bot, deleted chat, bad request) fails.
+    # A recipient that is unreachable DORMANT_AFTER times in a row is marked
+    # dormant and left out of fan-outs until they message the bot again.
+    def __init__(self, bucket, max_rate=SEND_RATE, min_rate=SEND_RATE_MIN, step=SEND_RATE_STEP,
+                 backoff=SEND_RATE_BACKOFF, retries=SEND_RETRIES, retry_base=SEND_RETRY_BASE):
+        self.bucket = bucket
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.step = step
+        self.backoff = backoff
+        self.retries = retries
+        self.retry_base = retry_base
+        self.paused_until = 0.0
+        self.adjusted = time.monotonic()
+        self.throttled = 0
+        self.unreachable = {}
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def _increase(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            # A send that was in flight when the flood wait began; the rate
+            # only starts climbing again once the pause is over.
+            return
+        if self.bucket.rate < self.max_rate:
+            rate = self.bucket.rate + self.step * max(0, now - self.adjusted)
+            self.bucket.rate = max(self.min_rate, min(self.max_rate, rate))
+            self.bucket.capacity = max(1, self.bucket.rate)
+        self.adjusted = now
+
+    def _throttle(self, retry_after):
+        now = time.monotonic()
+        self.throttled += 1
+        # Every in-flight send sees the same flood wait; cut the rate once per pause.
+        if now >= self.paused_until:
+            self.bucket.rate = max(self.min_rate, self.bucket.rate * self.backoff)
+            logger.warning("Throttled by Telegram for %ss, send rate now %.1f/s", retry_after, self.bucket.rate)
+        self.paused_until = max(self.paused_until, now + retry_after)
+        self.adjusted = self.paused_until
+        self.bucket.drain(self.paused_until)
+
+    async def _wait_pause(self):
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay + random.uniform(0, 0.5))
+
+    async def _unreachable(self, uid):
+        strikes = self.unreachable[uid] = self.unreachable.get(uid, 0) + 1
+        if strikes >= DORMANT_AFTER:
+            del self.unreachable[uid]
+            try:
+                await aset_dormant(uid, True)
+            except Exception:
+                logger.exception("Could not mark %s dormant", uid)
+                return
+            logger.info("Marked %s dormant after %s failed sends", uid, strikes)
+
+    async def send(self, stats, uid, send):
+        await chat_limiter.wait(uid)
+        for attempt in range(self.retries + 1):
+            await self._wait_pause()
+            await self.bucket.acquire()
+            try:
+                result = await send(uid)
+            except RetryAfter as e:
+                SEND_OUTCOMES.inc("RetryAfter")
+                self._throttle(_seconds(e.retry_after))
+            except (Forbidden, BadRequest) as e:
+                SEND_OUTCOMES.inc(type(e).__name__)
+                if is_unreachable(e):
+                    await self._unreachable(uid)
+                break
+            except (TimedOut, NetworkError) as e:
+                SEND_OUTCOMES.inc(type(e).__name__)
+                await asyncio.sleep(self.retry_base * 2 ** attempt * random.uniform(0.5, 1.5))
+            except Exception as e:
+                SEND_OUTCOMES.inc(type(e).__name__)
+                break
+            else:
+                SEND_OUTCOMES.inc("delivered")
+                self._increase()
+                if uid in self.unreachable:
+                    del self.unreachable[uid]
+                stats.delivered += 1
+                return result
+            if attempt < self.retries:
+                stats.retried += 1
+        stats.failed += 1
+        return None
+
+UNREACHABLE_REASONS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+def is_unreachable(error):
+    # Forbidden: the member blocked the bot or deleted their account. A few
+    # BadRequests mean the chat is gone; the rest are about the message itself.
+    if isinstance(error, Forbidden):
+        return True
+    reason = error.message.lower()
+    return any(r in reason for r in UNREACHABLE_REASONS)
+
+def _seconds(retry_after):
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else retry_after
+
+send_bucket = TokenBucket(SEND_RATE)
+chat_limiter = ChatLimiter(PER_CHAT_INTERVAL)
+send_controller = SendController(send_bucket)
+RECENT_BROADCASTS = deque(maxlen=20)
+
+async def deliver(stats, uid, send):
+    return await send_controller.send(stats, uid, send)
+
+def finish(stats):
+    stats.finish()
+    BROADCAST_SECONDS.observe(stats.duration, stats.label.split()[0])
+    RECENT_BROADCASTS.append(stats)
+    logger.info("%s", stats)
+
+async def fan_out(user_ids, send, label="broadcast", concurrency=BROADCAST_CONCURRENCY):
+    # send(uid) is awaited once per recipient; up to `concurrency` run at once,
+    # all sharing the bot-wide token bucket and the per-chat limiter. send
+    # must let Telegram errors propagate so throttling and retries work.
+    stats = BroadcastStats(label, len(user_ids))
+    pending = iter(user_ids)
+
+    async def worker():
+        for uid in pending:
+            await deliver(stats, uid, send)
+
+    workers = min(concurrency, len(user_ids))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    finish(stats)
+    return stats
+
+async def broadcast_text(bot, user_ids, text, label="broadcast", **kwargs):
+    async def send(uid):
+        return await bot.send_message(uid, text, **kwargs)
+    return await fan_out(list(user_ids), send, label)
+
+class DeliveryScheduler:
+    # Chat messages are delivered from the durable outbox table: a dispatcher
+    # claims rows in (message, recipient) order and spreads them over
+    # DELIVERY_SHARDS bounded queues, one worker each. A recipient always maps
+    # to the same shard, so every member receives messages in order. Each send
+    # is recorded through database.map_telegram_to_db/finish_outbox, which
+    # removes the outbox row; rows still in the table at startup are resumed.
+    # `pending` counts sends not yet attempted and drives backpressure. A job's
+    # total is the number of its rows the dispatcher has queued, so it is done
+    # exactly when the workers have taken all of them.
+    def __init__(self, shards=DELIVERY_SHARDS, queue_size=DELIVERY_QUEUE_SIZE):
+        self.shard_count = shards
+        self.queue_size = queue_size
+        self.render = None
+        self.wakeup = None
+        self.shards = []
+        self.tasks = []
+        self.jobs = {}
+        self.cancelled = set()
+        self.pending = 0
+
+    def start(self, render):
+        # render(db_message_id) returns a send(uid) coroutine function, or
+        # None when the message no longer exists.
+        self.render = render
+        reset_outbox_claims()
+        self.pending = count_outbox()
+        self.wakeup = asyncio.Event()
+        self.shards = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.shard_count)]
+        self.tasks = [asyncio.create_task(_supervise("delivery dispatcher", self._dispatch))]
+        self.tasks += [
+            asyncio.create_task(_supervise(f"delivery shard {i}", self._work, queue))
+            for i, queue in enumerate(self.shards)
+        ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def depth(self):
+        return self.pending
+
+    def backlogged(self):
+        return self.pending >= DELIVERY_BACKLOG_LIMIT
+
+    def notify(self, count):
+        self.pending += count
+        if self.wakeup:
+            self.wakeup.set()
+
+    def cancel(self, db_message_id, unsent):
+        # The message was deleted along with its `unsent` unclaimed outbox
+        # rows. Rows already claimed are dropped when a worker reaches them;
+        # `cancelled` covers a batch the dispatcher is still preparing.
+        self.pending -= unsent
+        self.cancelled.add(db_message_id)
+        job = self.jobs.get(db_message_id)
+        if job:
+            self.jobs[db_message_id] = (job[0], None)
+
+    async def _dispatch(self):
+        while True:
+            self.wakeup.clear()
+            self.cancelled.clear()
+            rows = await aclaim_outbox(OUTBOX_CLAIM_BATCH)
+            if not rows:
+                await self.wakeup.wait()
+                continue
+            try:
+                sends = {}
+                for db_message_id, _ in rows:
+                    if db_message_id not in sends:
+                        job = self.jobs.get(db_message_id)
+                        sends[db_message_id] = job[1] if job else await self.render(db_message_id)
+            except Exception:
+                await arelease_outbox(rows)
+                raise
+            # No awaits until every claimed row is counted in its job, so a
+            # worker cannot finish a job the batch still adds to.
+            for db_message_id, _ in rows:
+                job = self.jobs.get(db_message_id)
+                if job is None:
+                    stats = BroadcastStats(f"message {db_message_id}", 0)
+                    job = self.jobs[db_message_id] = (stats, sends[db_message_id])
+                if db_message_id in self.cancelled:
+                    job = self.jobs[db_message_id] = (job[0], None)
+                job[0].total += 1
+            for db_message_id, uid in rows:
+                await self.shards[uid % self.shard_count].put((db_message_id, uid))
+
+    async def _work(self, queue):
+        while True:
+            db_message_id, uid = await queue.get()
+            try:
+                await self._deliver(db_message_id, uid)
+            except Exception:
+                # map_telegram_to_db/finish_outbox buffer the row before they
+                # flush, so a failed flush is retried by the next one.
+                logger.exception("Delivery of message %s to %s failed", db_message_id, uid)
+
+    async def _deliver(self, db_message_id, uid):
+        job = self.jobs.get(db_message_id)
+        sent = None
+        cancelled = False
+        if job and job[1]:
+            sent = await deliver(job[0], uid, job[1])
+            current = self.jobs.get(db_message_id)
+            cancelled = not current or current[1] is None
+        elif job:
+            job[0].failed += 1
+        self.pending -= 1
+        # Checked before the next await, so exactly one worker finishes a job.
+        if job and job[0].done:
+            finish(job[0])
+            del self.jobs[db_message_id]
+        if sent and cancelled:
+            # Deleted while this copy was in flight, after /delete collected
+            # the copies to remove.
+            await sent.delete()
+        elif sent:
+            await amap_telegram_to_db(sent.message_id, db_message_id, uid)
+        else:
+            await afinish_outbox(db_message_id, uid)
+
+async def _supervise(name, loop, *args):
+    # Keeps a long-lived loop running: an unexpected error is logged and the
+    # loop restarted after a short pause instead of ending it silently.
+    while True:
+        try:
+            await loop(*args)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("%s crashed, restarting", name)
+            await asyncio.sleep(1)
+
+delivery = DeliveryScheduler()
@@ -0,0 +1,182 @@
+import asyncio
+import bisect
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Minimal Prometheus text-format metrics, no client library needed. Metrics
+# are always collected (a dict update per observation); the HTTP endpoint is
+# only started when METRICS_PORT is set (see bot.main).
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+REGISTRY = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        # series: [count per bucket (+Inf last), sum]
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = _labels(self.labels + ("le",), labels + (bound,))
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+class Gauge:
+    # Read when scraped: fn() returns the current value.
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        REGISTRY.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            yield f"{self.name} {self.fn()}"
+        except Exception:
+            logger.exception("Gauge %s failed", self.name)
+
+class Snapshot:
+    # Labelled values read when scraped: fn() returns {label values: value}.
+    def __init__(self, name, help, type, labels, fn):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = labels
+        self.fn = fn
+        REGISTRY.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        try:
+            for labels, value in self.fn().items():
+                yield f"{self.name}{_labels(self.labels, labels)} {value}"
+        except Exception:
+            logger.exception("Snapshot %s failed", self.name)
+
+HANDLER_SECONDS = Histogram("chatbot_handler_seconds", "Handler callback latency.", ("handler",))
+HANDLER_ERRORS = Counter("chatbot_handler_errors_total", "Handler callbacks that raised.", ("handler",))
+BROADCAST_SECONDS = Histogram(
+    "chatbot_broadcast_seconds", "Time from start to last send of a fan-out.", ("kind",), DURATION_BUCKETS
+)
+SEND_OUTCOMES = Counter("chatbot_send_outcomes_total", "Send attempts by outcome or error class.", ("outcome",))
+DB_SECONDS = Histogram(
+    "chatbot_db_seconds", "Latency of awaited database.py calls, including the wait for the DB thread.", ("function",)
+)
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def instrument_handlers(app):
+    # Wraps every registered handler callback with a latency histogram.
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = _timed(handler.callback)
+
+def _timed(callback):
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+async def _serve(reader, writer):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        parts = request.split()
+        if len(parts) > 1 and parts[1] == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def start_metrics_server(host, port):
+    server = await asyncio.start_server(_serve, host, port)
+    logger.info("Metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -1,121 +1,81 @@
 from telegram import Update
 from telegram.ext import CommandHandler, ContextTypes
-from database import get_all_joined_users, get_user
-from utils import is_admin
+from database import get_all_joined_users, aget_user, is_admin, get_setting, aset_setting
+from fanout import broadcast_text
 
 import datetime
 
-LOCKDOWN = False
-SILENT = False
-PINNED_NOTICE = None
-
 async def send_welcome(user_id, context):
-    user = get_user(user_id)
+    user = await aget_user(user_id)
     text = f"👋 <b>Welcome</b> {user[2]} (@{user[1]}) to the chatroom!"
-    for uid in get_all_joined_users():
-        try:
-            await context.bot.send_message(uid, text, parse_mode="HTML")
-        except Exception:
-            pass
+    await broadcast_text(context.bot, get_all_joined_users(), text, label="welcome", parse_mode="HTML")
 
 async def send_goodbye(user_id, context):
-    user = get_user(user_id)
+    user = await aget_user(user_id)
     text = f"👋 <b>{user[2]}</b> (@{user[1]}) has left the chatroom."
-    for uid in get_all_joined_users():
-        try:
-            await context.bot.send_message(uid, text, parse_mode="HTML")
-        except Exception:
-            pass
+    await broadcast_text(context.bot, get_all_joined_users(), text, label="goodbye", parse_mode="HTML")
 
 async def lockdown(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global LOCKDOWN
     user = update.effective_user
     if not is_admin(user.id):
         return
-    LOCKDOWN = True
+    await aset_setting("lockdown", 1)
     text = "🚨 <b>Chatroom is now in lockdown! Only admins can send messages.</b>"
-    for uid in get_all_joined_users():
-        try:
-            await context.bot.send_message(uid, text, parse_mode="HTML")
-        except Exception:
-            pass
+    await broadcast_text(context.bot, get_all_joined_users(), text, label="lockdown", parse_mode="HTML")
 
 async def unlock(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global LOCKDOWN
     user = update.effective_user
     if not is_admin(user.id):
         return
-    LOCKDOWN = False
+    await aset_setting("lockdown", 0)
     text = "✅ <b>Lockdown lifted! Everyone can chat again.</b>"
-    for uid in get_all_joined_users():
-        try:
-            await context.bot.send_message(uid, text, parse_mode="HTML")
-        except Exception:
-            pass
+    await broadcast_text(context.bot, get_all_joined_users(), text, label="unlock", parse_mode="HTML")
 
 def is_lockdown():
-    return LOCKDOWN
+    return bool(get_setting("lockdown", 0))
 
 async def silent(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global SILENT
     user = update.effective_user
     if not is_admin(user.id):
         return
-    SILENT = True
+    await aset_setting("silent", 1)
     text = "🔕 <b>Silent mode enabled!</b> Only admins may speak (for announcements)."
-    for uid in get_all_joined_users():
-        try:
-            await context.bot.send_message(uid, text, parse_mode="HTML")
-        except Exception:
-            pass
+    await broadcast_text(context.bot, get_all_joined_users(), text, label="silent", parse_mode="HTML")
 
 async def unsilent(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global SILENT
     user = update.effective_user
     if not is_admin(user.id):
         return
-    SILENT = False
+    await aset_setting("silent", 0)
     text = "🔔 <b>Silent mode disabled.</b> Everyone may speak again."
-    for uid in get_all_joined_users():
-        try:
-            await context.bot.send_message(uid, text, parse_mode="HTML")
-        except Exception:
-            pass
+    await broadcast_text(context.bot, get_all_joined_users(), text, label="unsilent", parse_mode="HTML")
 
 def is_silent():
-    return SILENT
+    return bool(get_setting("silent", 0))
 
-async def pin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global PINNED_NOTICE
+async def notice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not is_admin(user.id):
         return
     if not context.args:
-        await update.message.reply_text("Usage: /pin <notice>")
+        current = get_pinned_notice()
+        await update.message.reply_text(f"Current notice: {current}" if current else "Usage: /notice <text>")
         return
-    PINNED_NOTICE = " ".join(context.args)
-    text = f"📌 <b>Pinned Notice:</b>\n{PINNED_NOTICE}"
-    for uid in get_all_joined_users():
-        try:
-            await context.bot.send_message(uid, text, parse_mode="HTML")
-        except Exception:
-            pass
+    notice = " ".join(context.args)
+    await aset_setting("pinned_notice", notice)
+    text = f"📌 <b>Pinned Notice:</b>\n{notice}"
+    await broadcast_text(context.bot, get_all_joined_users(), text, label="notice", parse_mode="HTML")
 
-async def unpin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global PINNED_NOTICE
+async def unnotice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not is_admin(user.id):
         return
-    PINNED_NOTICE = None
+    await aset_setting("pinned_notice", None)
     text = "📌 <b>Pinned Notice has been removed.</b>"
-    for uid in get_all_joined_users():
-        try:
-            await context.bot.send_message(uid, text, parse_mode="HTML")
-        except Exception:
-            pass
+    await broadcast_text(context.bot, get_all_joined_users(), text, label="unnotice", parse_mode="HTML")
 
 def get_pinned_notice():
-    return PINNED_NOTICE
+    return get_setting("pinned_notice")
 
 async def motd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -125,18 +85,14 @@ async def motd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /motd <message>")
         return
     text = "💡 <b>Message of the Day:</b>\n" + " ".join(context.args)
-    for uid in get_all_joined_users():
-        try:
-            await context.bot.send_message(uid, text, parse_mode="HTML")
-        except Exception:
-            pass
+    await broadcast_text(context.bot, get_all_joined_users(), text, label="motd", parse_mode="HTML")
 
 def register_system_handlers(app):
     app.add_handler(CommandHandler("lockdown", lockdown))
     app.add_handler(CommandHandler("unlock", unlock))
     app.add_handler(CommandHandler("silent", silent))
     app.add_handler(CommandHandler("unsilent", unsilent))
-    app.add_handler(CommandHandler("pin", pin))
-    app.add_handler(CommandHandler("unpin", unpin))
+    app.add_handler(CommandHandler("notice", notice))
+    app.add_handler(CommandHandler("unnotice", unnotice))
     app.add_handler(CommandHandler("motd", motd))
 
@@ -0,0 +1,42 @@
+import os
+import sys
+import threading
+import types
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config.py ships with placeholders to fill in (ADMINS = [here]); load it with
+# a dummy admin so the tests run against the real defaults.
+config = types.ModuleType("config")
+config.here = 1
+with open(os.path.join(ROOT, "config.py")) as f:
+    exec(compile(f.read(), "config.py", "exec"), config.__dict__)
+sys.modules["config"] = config
+
+# The handler modules are deployed inside a handlers/ folder (see readme).
+handlers = types.ModuleType("handlers")
+handlers.__path__ = [ROOT]
+sys.modules["handlers"] = handlers
+
+import database
+
+@pytest.fixture
+def empty_db(tmp_path, monkeypatch):
+    # A fresh database file, not yet migrated, and empty caches; the DB
+    # thread opens its own connection to it on first use.
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(database, "_local", threading.local())
+    monkeypatch.setattr(database, "_roster", database.Roster())
+    monkeypatch.setattr(database, "_settings", None)
+    database._map_buffer.clear()
+    database._outbox_done.clear()
+    database._gate_users.clear()
+    yield database
+    database.flush_telegram_map()
+
+@pytest.fixture
+def db(empty_db):
+    empty_db.init_db()
+    return empty_db
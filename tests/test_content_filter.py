@@ -0,0 +1,63 @@
+import sys
+from content_filter import ContentFilter
+
+def make(*rules):
+    f = ContentFilter()
+    f.load(rules)
+    return f
+
+def test_keyword_matches_whole_words_only():
+    f = make(("keyword", "spam"))
+    assert f.scan("buy SPAM now") == ("keyword", "spam")
+    assert f.scan("spams and spammer") is None
+    assert f.scan("antispam") is None
+
+def test_domain_does_not_match_inside_other_domains():
+    f = make(("domain", "evil.com"))
+    assert f.scan("see https://evil.com/x") == ("domain", "evil.com")
+    assert f.scan("sub.evil.com works too") == ("domain", "evil.com")
+    assert f.scan("notevil.com") is None
+    assert f.scan("not-evil.com") is None
+    assert f.scan("evil.community") is None
+
+def test_shared_prefixes():
+    f = make(("keyword", "scam"), ("keyword", "scammer"), ("keyword", "scat"))
+    assert f.scan("a scammer") == ("keyword", "scammer")
+    assert f.scan("a scam") == ("keyword", "scam")
+    assert f.scan("scat") == ("keyword", "scat")
+    assert f.scan("scamm") is None
+
+def test_remove_prunes_the_trie():
+    f = make(("keyword", "scam"), ("keyword", "scammer"))
+    f.remove("keyword", "scammer")
+    assert f.tries["keyword"] == {"s": {"c": {"a": {"m": {"": True}}}}}
+    assert f.scan("scammer") is None
+    assert f.scan("scam") == ("keyword", "scam")
+    f.remove("keyword", "scam")
+    assert f.tries["keyword"] == {}
+    assert f.counts["keyword"] == 0
+    assert f.scan("scam") is None
+
+def test_remove_unknown_pattern_is_a_no_op():
+    f = make(("keyword", "scam"))
+    f.remove("keyword", "sc")
+    f.remove("keyword", "scammer")
+    assert f.scan("scam") == ("keyword", "scam")
+
+def test_long_patterns_compile():
+    long_word = "x" * (sys.getrecursionlimit() + 500)
+    f = make(("keyword", "spam"), ("keyword", long_word))
+    assert f.scan(f"say {long_word}") == ("keyword", long_word)
+    assert f.scan("spam") == ("keyword", "spam")
+
+def test_failed_compile_keeps_previous_pattern(monkeypatch):
+    import content_filter
+    f = make(("keyword", "spam"))
+    assert f.scan("spam")
+
+    def broken(root):
+        raise RecursionError
+    monkeypatch.setattr(content_filter, "_trie_regex", broken)
+    f.add("keyword", "eggs")
+    assert f.scan("spam") == ("keyword", "spam")
+    assert f.scan("spam") == ("keyword", "spam")
@@ -0,0 +1,163 @@
+import asyncio
+import itertools
+import types
+import pytest
+import fanout
+from fanout import DeliveryScheduler
+
+_message_ids = itertools.count(1000)
+
+@pytest.fixture(autouse=True)
+def fast_sends(monkeypatch):
+    monkeypatch.setattr(fanout.chat_limiter, "interval", 0)
+    monkeypatch.setattr(fanout.send_bucket, "rate", 10000)
+    monkeypatch.setattr(fanout.send_bucket, "capacity", 10000)
+
+class Recorder:
+    # Stands in for chat.render_message: records (uid, db_message_id) sends.
+    def __init__(self, db):
+        self.db = db
+        self.sent = []
+        self.deleted = []
+
+    async def render(self, db_message_id):
+        if not await self.db.aget_message_by_id(db_message_id):
+            return None
+
+        async def send(uid):
+            self.sent.append((uid, db_message_id))
+            return types.SimpleNamespace(message_id=next(_message_ids), delete=lambda: self._delete(uid))
+        return send
+
+    async def _delete(self, uid):
+        self.deleted.append(uid)
+
+async def post(db, scheduler, recipients):
+    msg_id = await db.aadd_message(1, "hi", "text", None, None, recipients)
+    scheduler.notify(len(recipients))
+    return msg_id
+
+async def drain(scheduler, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if not scheduler.pending and not scheduler.jobs:
+            return
+        assert not any(task.done() for task in scheduler.tasks)
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{scheduler.pending} sends still pending")
+
+def run(test):
+    async def main():
+        scheduler = DeliveryScheduler(shards=4)
+        try:
+            await test(scheduler)
+        finally:
+            await scheduler.stop()
+    asyncio.run(main())
+
+def test_members_receive_messages_in_order(db):
+    recorder = Recorder(db)
+    recipients = list(range(100, 130))
+
+    async def test(scheduler):
+        scheduler.start(recorder.render)
+        ids = [await post(db, scheduler, recipients) for _ in range(5)]
+        await drain(scheduler)
+        for uid in recipients:
+            assert [m for u, m in recorder.sent if u == uid] == ids
+        db.flush_telegram_map()
+        assert db.count_outbox() == 0
+    run(test)
+
+def test_claimed_rows_are_resumed_after_restart(db):
+    recorder = Recorder(db)
+    msg_id = db.add_message(1, "hi", "text", None, None, range(100, 110))
+    db.claim_outbox(4)
+
+    async def test(scheduler):
+        scheduler.start(recorder.render)
+        await drain(scheduler)
+        assert sorted(u for u, _ in recorder.sent) == list(range(100, 110))
+        assert all(m == msg_id for _, m in recorder.sent)
+    run(test)
+
+def test_delete_while_rendering(db):
+    recorder = Recorder(db)
+    rendering = asyncio.Event()
+    release = None
+    recipients = list(range(100, 110))
+
+    async def render(db_message_id):
+        rendering.set()
+        await release.wait()
+        return await recorder.render(db_message_id)
+
+    async def test(scheduler):
+        nonlocal release
+        release = asyncio.Event()
+        scheduler.start(render)
+        msg_id = await post(db, scheduler, recipients)
+        await rendering.wait()
+        _, unsent = await db.apurge_message(msg_id)
+        assert unsent == 0
+        scheduler.cancel(msg_id, unsent)
+        release.set()
+        await drain(scheduler)
+        assert recorder.sent == []
+
+        # Every shard is still alive and delivers the next message.
+        next_id = await post(db, scheduler, recipients)
+        await drain(scheduler)
+        assert sorted(u for u, m in recorder.sent if m == next_id) == recipients
+    run(test)
+
+def test_delete_while_queued(db):
+    recorder = Recorder(db)
+    recipients = list(range(100, 140))
+
+    async def test(scheduler):
+        scheduler.start(recorder.render)
+        msg_id = await post(db, scheduler, recipients)
+        await asyncio.sleep(0)
+        copies, unsent = await db.apurge_message(msg_id)
+        scheduler.cancel(msg_id, unsent)
+        await drain(scheduler)
+        db.flush_telegram_map()
+        assert db.count_outbox() == 0
+        assert len(copies) + len(recorder.deleted) == len(recorder.sent)
+    run(test)
+
+def test_dispatcher_survives_render_errors(db):
+    recorder = Recorder(db)
+    failures = [RuntimeError("database is locked")]
+
+    async def render(db_message_id):
+        if failures:
+            raise failures.pop()
+        return await recorder.render(db_message_id)
+
+    async def test(scheduler):
+        scheduler.start(render)
+        await post(db, scheduler, [100, 101])
+        await drain(scheduler)
+        assert sorted(u for u, _ in recorder.sent) == [100, 101]
+    run(test)
+
+def test_workers_survive_recording_errors(db, monkeypatch):
+    recorder = Recorder(db)
+    failures = [RuntimeError("database is locked")]
+    record = fanout.amap_telegram_to_db
+
+    async def flaky_record(*args):
+        if failures:
+            raise failures.pop()
+        await record(*args)
+    monkeypatch.setattr(fanout, "amap_telegram_to_db", flaky_record)
+
+    async def test(scheduler):
+        scheduler.start(recorder.render)
+        await post(db, scheduler, [100])
+        await drain(scheduler)
+        second = await post(db, scheduler, [100])
+        await drain(scheduler)
+        assert recorder.sent[-1] == (100, second)
+    run(test)
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+from handlers.admin import parse_search_args
+
+def insert(db, rows):
+    # rows: (id, user_id, content, timestamp); the insert trigger indexes them.
+    with db.connect() as con:
+        con.executemany(
+            "INSERT INTO messages (id, user_id, content, media_type, timestamp) VALUES (?, ?, ?, 'text', ?)", rows
+        )
+
+def ids(result):
+    rows, _ = result
+    return [row[0] for row in rows]
+
+def midnight(value):
+    return int(datetime.datetime.strptime(value, "%Y-%m-%d").timestamp())
+
+def parse(*args):
+    return asyncio.run(parse_search_args(list(args)))
+
+def test_parse_search_args(db):
+    db.add_user(5, "alice", "Alice")
+    assert parse("hello", "world") == (["hello", "world"], {})
+    assert parse("hello", "from:@alice") == (["hello"], {"user_id": 5})
+    assert parse("hello", "from:5") == (["hello"], {"user_id": 5})
+    assert parse("hello", "since:2024-05-01") == (["hello"], {"since": midnight("2024-05-01")})
+    # until is inclusive: the whole day is searched.
+    assert parse("hello", "until:2024-05-01") == (["hello"], {"until": midnight("2024-05-02")})
+    assert parse("hello", "in:archive") == (["hello"], {"archive": True})
+    assert parse("from:", "in:other") == (["from:", "in:other"], {})
+
+def test_parse_search_args_rejects_bad_values(db):
+    assert parse("hello", "from:@nobody") is None
+    assert parse("hello", "from:42") is None
+    assert parse("hello", "since:2024-13-01") is None
+    assert parse("hello", "until:yesterday") is None
+
+def test_ranking_and_snippets(db):
+    insert(db, [
+        (1, 5, "apple banana cherry date elderberry fig grape", 100),
+        (2, 5, "apple apple apple", 100),
+        (3, 5, "banana only", 100),
+    ])
+    rows, has_next = db.search_messages(["apple"])
+    assert [row[0] for row in rows] == [2, 1]
+    assert not has_next
+    assert "\x02apple\x03" in rows[0][4]
+    assert ids(db.search_messages(["appl*"])) == [2, 1]
+    assert ids(db.search_messages(["apple", "banana"])) == [1]
+    assert db.search_messages(['"', "*"]) == ([], False)
+
+def test_paging(db):
+    insert(db, [(i, 5, f"common word {i}", 100 + i) for i in range(1, 26)])
+    seen = []
+    for offset, more in ((0, True), (10, True), (20, False)):
+        rows, has_next = db.search_messages(["common"], offset=offset, limit=10)
+        assert has_next == more
+        seen += [row[0] for row in rows]
+    assert sorted(seen) == list(range(1, 26))
+    assert len(set(seen)) == 25
+
+def test_user_filter(db):
+    insert(db, [(1, 5, "hello there", 100), (2, 6, "hello again", 100), (3, 5, "hello", 100)])
+    assert sorted(ids(db.search_messages(["hello"], user_id=5))) == [1, 3]
+    assert ids(db.search_messages(["hello"], user_id=7)) == []
+
+def test_date_bounds_with_equal_timestamps(db):
+    insert(db, [
+        (1, 5, "tick", 100),
+        (2, 5, "tick", 200),
+        (3, 5, "tick", 200),
+        (4, 5, "tick", 200),
+        (5, 5, "tick", 300),
+        (6, 5, "tick", 300),
+    ])
+    assert sorted(ids(db.search_messages(["tick"], since=200))) == [2, 3, 4, 5, 6]
+    assert sorted(ids(db.search_messages(["tick"], until=300))) == [1, 2, 3, 4]
+    assert sorted(ids(db.search_messages(["tick"], since=200, until=201))) == [2, 3, 4]
+    assert sorted(ids(db.search_messages(["tick"], since=150, until=250))) == [2, 3, 4]
+    assert ids(db.search_messages(["tick"], since=301)) == []
+    assert ids(db.search_messages(["tick"], until=100)) == []
+
+def test_backfill_after_upgrade(empty_db):
+    db = empty_db
+    # A database from before the search index: migrate up to version 9 only.
+    con = db.connect()
+    for version, migrate in db.MIGRATIONS:
+        if version < 10:
+            with con:
+                migrate(con)
+                con.execute(f"PRAGMA user_version={version}")
+    insert(db, [(i, 5, f"old message {i}", 100 + i) for i in range(1, 51)])
+
+    db.init_db()
+    assert db.get_setting("fts_backfill") == 50
+    insert(db, [(51, 5, "new message", 200)])
+    # New rows are indexed right away; old ones only once backfilled.
+    assert ids(db.search_messages(["message"])) == [51]
+    # Deleting a row that is not indexed yet must not touch the index.
+    db.delete_message(10)
+
+    covered = 0
+    while True:
+        step = db.backfill_messages_fts(7)
+        if not step:
+            break
+        covered += step
+    assert covered == 50
+    assert db.get_setting("fts_backfill") == 0
+    found = ids(db.search_messages(["message"], limit=100))
+    assert sorted(found) == [i for i in range(1, 52) if i != 10]
+    con.execute("INSERT INTO messages_fts (messages_fts) VALUES ('integrity-check')")
@@ -0,0 +1,34 @@
+import asyncio
+import time
+from fanout import SendController, TokenBucket
+
+def test_no_burst_after_flood_wait():
+    async def main():
+        bucket = TokenBucket(30)
+        controller = SendController(bucket)
+        controller._throttle(0.5)
+        assert bucket.rate == 15
+        await asyncio.sleep(0.6)
+        started = time.monotonic()
+        sent = 0
+        while time.monotonic() - started < 0.1:
+            await bucket.acquire()
+            sent += 1
+        # About 3 at 15/s (0.1s accrued after the pause plus the 0.1s window);
+        # the old bucket released its full capacity of 30 at once.
+        assert sent < 6
+    asyncio.run(main())
+
+def test_send_during_pause_keeps_rate_positive():
+    async def main():
+        bucket = TokenBucket(30)
+        controller = SendController(bucket)
+        controller._throttle(30)
+        # A send that was already in flight succeeds during the pause.
+        controller._increase()
+        assert bucket.rate == 15
+        assert bucket.capacity >= 1
+        controller.paused_until = controller.adjusted = time.monotonic()
+        bucket.updated = time.monotonic()
+        await asyncio.wait_for(bucket.acquire(), 1)
+    asyncio.run(main())
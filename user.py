@@ -1,10 +1,11 @@
 from telegram import Update
-from telegram.ext import CommandHandler, ContextTypes
+from telegram.ext import CommandHandler, ContextTypes, TypeHandler
 import datetime
 from config import ADMINS
+from fanout import broadcast_text
 from database import (
-    add_user, remove_user, is_joined, is_pending, get_user, get_user_by_username,
-    is_admin, get_welcome, get_all_joined_users, is_vendor, get_toggle
+    aadd_user, aremove_user, is_joined, is_pending, aget_user, aget_user_by_username,
+    is_admin, aget_welcome, get_all_joined_users, is_vendor, get_toggle, is_dormant, aset_dormant
 )
 import time
 from collections import deque
@@ -40,36 +41,30 @@ async def join(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await detect_name_change(user, context)
     approval_mode = get_toggle("approval_mode")
-    add_user(user.id, user.username or "", user.full_name, approval_mode=approval_mode)
+    await aadd_user(user.id, user.username or "", user.full_name, approval_mode=approval_mode)
     if approval_mode:
         await update.message.reply_text(
             "✅ You have requested to join. Please wait for admin approval."
         )
         from config import ADMINS  # important if needed for runtime changes
-        for admin_id in ADMINS:
-            try:
-                await context.bot.send_message(
-                    admin_id,
-                    f"🕐 New join request: {user.full_name} (@{user.username or 'No username'}) <code>{user.id}</code>",
-                    parse_mode="HTML"
-                )
-            except Exception:
-                pass
+        await broadcast_text(
+            context.bot,
+            ADMINS,
+            f"🕐 New join request: {user.full_name} (@{user.username or 'No username'}) <code>{user.id}</code>",
+            label="join request",
+            parse_mode="HTML"
+        )
     else:
         joined_users = get_all_joined_users()
-        welcome = get_welcome()
+        welcome = await aget_welcome()
         count = len(joined_users)
         text = welcome.format(name=user.full_name, username=user.username or "N/A", count=count)
-        for uid in joined_users:
-            try:
-                await context.bot.send_message(uid, text)
-            except Exception:
-                pass
+        await broadcast_text(context.bot, joined_users, text, label="welcome")
 
 async def leave(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     await detect_name_change(user, context)
-    remove_user(user.id)
+    await aremove_user(user.id)
     await update.message.reply_text("❎ You have left the chatroom.")
 
 async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -81,17 +76,17 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         target = context.args[0]
         if target.startswith("@"):
-            u = get_user_by_username(target)
+            u = await aget_user_by_username(target)
         else:
             try:
-                u = get_user(int(target))
+                u = await aget_user(int(target))
             except Exception:
                 u = None
         if not u:
             await update.message.reply_text("User not found.")
             return
     else:
-        u = get_user(user.id)
+        u = await aget_user(user.id)
         if not u:
             await update.message.reply_text("Profile not found.")
             return
@@ -134,14 +129,15 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "<code>/join</code> - Request to join the chatroom\n"
         "<code>/leave</code> - Exit the chatroom\n"
         "<code>/profile</code> - Show your info\n"
+        "<code>/history [count|older|newer]</code> - Catch up on recent messages\n"
         "<code>/help</code> - This help\n"
         "\nAfter joining, just send messages to chat!"
     )
     await update.message.reply_html(text)
 
 async def detect_name_change(user, context):
-    from database import get_user, add_user, add_name_history, get_name_history
-    u = get_user(user.id)
+    from database import aget_user, aadd_user, aadd_name_history, aget_name_history
+    u = await aget_user(user.id)
     changed = False
     notice = ""
     if u:
@@ -152,9 +148,9 @@ async def detect_name_change(user, context):
             changed = True
             notice += f"Username change: <code>@{u[1] or 'None'}</code> → <code>@{user.username or 'None'}</code>\n"
     if changed:
-        add_user(user.id, user.username or "", user.full_name)
-        add_name_history(user.id, user.full_name, user.username or "")
-        history = get_name_history(user.id, limit=10)
+        await aadd_user(user.id, user.username or "", user.full_name)
+        await aadd_name_history(user.id, user.full_name, user.username or "")
+        history = await aget_name_history(user.id, limit=10)
         history_lines = []
         for entry in history:
             dt = datetime.datetime.fromtimestamp(entry[2]).strftime("%Y-%m-%d %H:%M")
@@ -166,13 +162,17 @@ async def detect_name_change(user, context):
             "\n".join(history_lines)
         )
         from config import ADMINS
-        for admin_id in ADMINS:
-            try:
-                await context.bot.send_message(admin_id, alert, parse_mode="HTML")
-            except Exception:
-                pass
+        await broadcast_text(context.bot, ADMINS, alert, label="name change", parse_mode="HTML")
+
+async def wake_dormant(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Runs in group -1 ahead of every other handler: a dormant member who
+    # messages the bot is reachable again and rejoins the fan-outs.
+    user = update.effective_user
+    if user and is_dormant(user.id):
+        await aset_dormant(user.id, False)
 
 def register_user_handlers(app):
+    app.add_handler(TypeHandler(Update, wake_dormant), group=-1)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("join", join))
     app.add_handler(CommandHandler("leave", leave))
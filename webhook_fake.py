@@ -0,0 +1,80 @@
+"""
+Local fake of Telegram's webhook delivery, for exercising webhook mode.
+
+Posts synthetic private-chat text updates to the bot's webhook server with the
+configured secret token and reports request latency. Run the bot with
+WEBHOOK_URL and WEBHOOK_SECRET set, then for example:
+
+    python webhook_fake.py --count 500 --users 50 --concurrency 20
+"""
+import argparse
+import itertools
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from config import WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+_update_ids = itertools.count(int(time.time()))
+
+def make_update(user_id, text):
+    update_id = next(_update_ids)
+    user = {"id": user_id, "is_bot": False, "first_name": f"Fake {user_id}", "username": f"fake{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        },
+    }
+
+def post_update(url, secret, update):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret or ""},
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default=f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--first-user-id", type=int, default=900000000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--text", default="fake message {n}")
+    args = parser.parse_args()
+
+    updates = [
+        make_update(args.first_user_id + n % args.users, args.text.format(n=n))
+        for n in range(args.count)
+    ]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(lambda u: post_update(args.url, args.secret, u), updates))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = sorted(latency for _, latency in results)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{len(results)} updates in {elapsed:.2f}s ({len(results) / elapsed:.1f}/s)")
+    print(f"status codes: {statuses}")
+    print(f"latency p50 {p50 * 1000:.1f}ms p99 {p99 * 1000:.1f}ms max {latencies[-1] * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()